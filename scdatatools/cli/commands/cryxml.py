@@ -1,9 +1,9 @@
-import json
+import sys
 import typing
 
 from nubia import command, argument
 
-from scdatatools.cryxml import etree_from_cryxml_file, dict_from_cryxml_file
+from scdatatools.cryxml import etree_from_cryxml_file, json_from_cryxml_file
 from scdatatools.cryxml.utils import pprint_xml_tree
 
 
@@ -31,9 +31,8 @@ def cryxml_to_xml(cryxml_file: typing.Text, output="-"):
     aliases=["-o"],
 )
 def cryxml_to_json(cryxml_file: typing.Text, output="-"):
-    data = dict_from_cryxml_file(cryxml_file)
     if output == "-":
-        print(json.dumps(data, indent=4))
+        json_from_cryxml_file(cryxml_file, sys.stdout, indent=4)
+        print()
     else:
-        with open(output, "w") as f:
-            json.dump(data, f, indent=4)
+        json_from_cryxml_file(cryxml_file, output, indent=4)
@@ -1,11 +1,18 @@
+import re
 import sys
+import fnmatch
 import shutil
 import typing
+import datetime
 from pathlib import Path
 
 from nubia import command, argument
 
 from scdatatools import p4k
+from scdatatools.utils import parse_size
+from scdatatools.p4k.bench import READ_METHODS, benchmark_reads
+from scdatatools.p4k.diff import diff_p4k
+from scdatatools.p4k.verify import DIGEST_ALGORITHMS, DEFAULT_DIGEST_ALGORITHM, P4KManifest, build_manifest
 
 
 @command(help="Extract files from a P4K file")
@@ -25,31 +32,130 @@ from scdatatools import p4k
     description="Posix style file filter of which files to extract. Defaults to '*'",
     aliases=["-f"],
 )
+@argument(
+    "workers",
+    description="Number of workers used to extract files in parallel. Use 0 for one worker per CPU. Defaults to 1",
+    aliases=["-j"],
+)
+@argument("processes", description="Use worker processes instead of threads when extracting in parallel")
+@argument(
+    "cryxml_workers",
+    description="Number of processes converting CryXML files to JSON with --convert-cryxml. Defaults to one per CPU",
+)
+@argument(
+    "pipeline",
+    description="Extract using separate read, decompress (using --workers threads) and write stages",
+)
+@argument(
+    "incremental",
+    description="Only extract files that changed since the last extraction into the output directory. This also "
+    "resumes an interrupted extraction",
+    aliases=["-i"],
+)
+@argument(
+    "archive",
+    description="Instead of extracting, stream the matching files into a single archive of this format. The "
+    "archive is written to the output path, or stdout if the output is '-'",
+    choices=p4k.ARCHIVE_FORMATS,
+)
+@argument(
+    "dedupe",
+    description="Only extract one copy of identical files, creating the duplicates as links of this type",
+    choices=p4k.DEDUPE_MODES,
+)
+@argument("min_size", description="Only files of at least this size, e.g. 100MB")
+@argument("max_size", description="Only files of at most this size, e.g. 64KB")
+@argument("min_compress_size", description="Only files of at least this compressed size, e.g. 100MB")
+@argument("max_compress_size", description="Only files of at most this compressed size, e.g. 64KB")
+@argument("min_ratio", description="Only files with at least this compression ratio (compressed / uncompressed size)")
+@argument("max_ratio", description="Only files with at most this compression ratio (compressed / uncompressed size)")
+@argument("compression", description="Only files with this compression method", choices=list(p4k.COMPRESS_TYPES))
+@argument("encrypted", description="Only encrypted (yes) or unencrypted (no) files", choices=["yes", "no"])
+@argument("modified_after", description="Only files modified after this ISO date, e.g. 2020-06-01")
+@argument("modified_before", description="Only files modified before this ISO date, e.g. 2020-06-01T12:00")
 def unp4k(
     p4k_file: typing.Text,
     output: typing.Text = ".",
     file_filter: typing.Text = "*",
     convert_cryxml: bool = False,
     single: bool = False,
+    workers: int = 1,
+    processes: bool = False,
+    cryxml_workers: int = 0,
+    incremental: bool = False,
+    pipeline: bool = False,
+    archive: typing.Text = "",
+    dedupe: typing.Text = "",
+    min_size: typing.Text = "",
+    max_size: typing.Text = "",
+    min_compress_size: typing.Text = "",
+    max_compress_size: typing.Text = "",
+    min_ratio: float = None,
+    max_ratio: float = None,
+    compression: typing.Text = "",
+    encrypted: typing.Text = "",
+    modified_after: typing.Text = "",
+    modified_before: typing.Text = "",
 ):
-    output = Path(output).absolute()
+    output = Path(output).absolute() if output != "-" else output
     p4k_file = Path(p4k_file)
     file_filter = file_filter.strip("'").strip('"')
 
+    if output == "-" and not archive:
+        sys.stderr.write("Extracting to stdout ('-o -') is only supported when writing an --archive\n")
+        sys.exit(1)
+
+    try:
+        conditions = {
+            "min_size": parse_size(min_size) if min_size else None,
+            "max_size": parse_size(max_size) if max_size else None,
+            "min_compress_size": parse_size(min_compress_size) if min_compress_size else None,
+            "max_compress_size": parse_size(max_compress_size) if max_compress_size else None,
+            "min_ratio": min_ratio,
+            "max_ratio": max_ratio,
+            "compress_type": compression or None,
+            "encrypted": {"yes": True, "no": False}.get(encrypted),
+            "modified_after": datetime.datetime.fromisoformat(modified_after) if modified_after else None,
+            "modified_before": datetime.datetime.fromisoformat(modified_before) if modified_before else None,
+        }
+    except ValueError as e:
+        sys.stderr.write(f"Invalid filter: {e}\n")
+        sys.exit(1)
+    conditions = {k: v for k, v in conditions.items() if v is not None}
+
     if not p4k_file.is_file():
         sys.stderr.write(f"Could not open p4k file {p4k_file}\n")
         sys.exit(1)
 
-    print(f"Opening p4k file: {p4k_file}")
+    # keep stdout clean when the archive is being streamed to it
+    print(f"Opening p4k file: {p4k_file}", file=sys.stderr if output == "-" else sys.stdout)
     try:
-        p = p4k.P4KFile(str(p4k_file))
+        p = p4k.P4KFile(str(p4k_file), index_cache=True)
     except KeyboardInterrupt:
         sys.exit(1)
 
-    if single:
+    def find(ignore_case=True):
+        if conditions:
+            return p.query(file_filter, ignore_case=ignore_case, **conditions)
+        return p.search(file_filter, ignore_case=ignore_case)
+
+    if archive:
+        members = find()
+        if output == "-":
+            sys.stderr.write(f"Writing {len(members)} files matching '{file_filter}' as {archive} to stdout\n")
+            p.write_archive(sys.stdout.buffer, members, archive_format=archive)
+            sys.stdout.buffer.flush()
+        else:
+            if output.is_dir():
+                output = output / f"{p4k_file.stem}.{archive}"
+            output.parent.mkdir(parents=True, exist_ok=True)
+            print(f"Writing {len(members)} files matching '{file_filter}' to {output}")
+            p.write_archive(str(output), members, archive_format=archive)
+
+    elif single:
         print(f"Extracting first match for filter '{file_filter}' to {output}")
         print("=" * 80)
-        found_files = p.search(file_filter)
+        found_files = find()
         if not found_files:
             sys.stderr.write(f"No files found for filter")
             sys.exit(2)
@@ -71,6 +177,159 @@ def unp4k(
         print("=" * 80)
         output.mkdir(parents=True, exist_ok=True)
         try:
-            p.extract_filter(file_filter=file_filter, path=str(output), convert_cryxml=convert_cryxml)
+            p.extractall(path=str(output), members=find(ignore_case=False), convert_cryxml=convert_cryxml,
+                         workers=workers, use_processes=processes, pipelined=pipeline, dedupe=dedupe or None,
+                         cryxml_workers=cryxml_workers,
+                         manifest=output / p4k.DEFAULT_EXTRACT_MANIFEST if incremental else None)
         except KeyboardInterrupt:
-            pass
+            if incremental:
+                print("Extraction interrupted, run the same command again to resume")
+
+
+@command
+class P4k:
+    """Inspect and compare P4K files"""
+
+    @command(help="Compare the files in two P4K files using their central directories")
+    @argument("old_p4k", description="The old P4K file", positional=True)
+    @argument("new_p4k", description="The new P4K file", positional=True)
+    @argument(
+        "verify",
+        description="Decompress and compare files whose size and CRC match but whose date or compression changed",
+    )
+    def diff(self, old_p4k: typing.Text, new_p4k: typing.Text, verify: bool = False):
+        for p4k_file in (old_p4k, new_p4k):
+            if not Path(p4k_file).is_file():
+                sys.stderr.write(f"Could not open p4k file {p4k_file}\n")
+                sys.exit(1)
+
+        old = p4k.P4KFile(old_p4k, index_cache=True)
+        new = p4k.P4KFile(new_p4k, index_cache=True)
+        d = diff_p4k(old, new, verify=verify)
+
+        for status, names in (("A", d.added), ("D", d.removed), ("M", d.changed), ("?", d.ambiguous)):
+            for name in sorted(names):
+                print(f"{status} {name}")
+        print("=" * 80)
+        print(f"{len(d.added)} added, {len(d.removed)} removed, {len(d.changed)} changed, {d.unchanged} unchanged")
+        if d.ambiguous:
+            print(f"{len(d.ambiguous)} files only changed date or compression, use --verify to compare them")
+
+    @command(help="Benchmark reading files from a P4K with an increasing number of threads")
+    @argument("p4k_file", description="P4K file to read from", positional=True)
+    @argument(
+        "file_filter",
+        description="Posix style file filter of which files to read. Defaults to '*'",
+        aliases=["-f"],
+    )
+    @argument("limit", description="Maximum number of files to read. Defaults to 10000", aliases=["-n"])
+    @argument("threads", description="Comma separated thread counts to benchmark. Defaults to 1,2,4,8", aliases=["-t"])
+    @argument("method", description="How files are read. Defaults to pread", choices=READ_METHODS)
+    def bench(self, p4k_file: typing.Text, file_filter: typing.Text = "*", limit: int = 10000,
+              threads: typing.Text = "1,2,4,8", method: typing.Text = "pread"):
+        if not Path(p4k_file).is_file():
+            sys.stderr.write(f"Could not open p4k file {p4k_file}\n")
+            sys.exit(1)
+
+        p = p4k.P4KFile(p4k_file, index_cache=True)
+        names = [name for name in p.search(file_filter.strip("'").strip('"')) if not name.endswith("/")][:limit]
+        thread_counts = [int(t) for t in threads.split(",")]
+
+        print(f"Reading {len(names)} files using {method}")
+        print("=" * 80)
+        results = benchmark_reads(p, names, thread_counts=thread_counts, method=method)
+        for result in results:
+            print(
+                f"{result.threads:>4} threads: {result.seconds:8.2f}s {result.mb_per_second:10.1f} MB/s "
+                f"{result.files_per_second:10.0f} files/s {result.mb_per_second / results[0].mb_per_second:6.2f}x"
+            )
+
+    @command(help="Compute a digest of the contents of every file in a P4K and save them to a manifest")
+    @argument("p4k_file", description="P4K file to hash", positional=True)
+    @argument(
+        "output",
+        description="Path to save the manifest to, or '-' for stdout. Defaults to <p4k name>.p4kmanifest in the "
+        "current directory",
+        aliases=["-o"],
+    )
+    @argument(
+        "file_filter",
+        description="Posix style file filter of which files to hash. Defaults to '*'",
+        aliases=["-f"],
+    )
+    @argument("algorithm", description="Digest algorithm. Defaults to blake2b", choices=DIGEST_ALGORITHMS)
+    @argument("workers", description="Number of workers. Defaults to one per CPU", aliases=["-j"])
+    @argument("processes", description="Use worker processes instead of threads")
+    def manifest(self, p4k_file: typing.Text, output: typing.Text = "", file_filter: typing.Text = "*",
+                 algorithm: typing.Text = DEFAULT_DIGEST_ALGORITHM, workers: int = 0, processes: bool = False):
+        if not Path(p4k_file).is_file():
+            sys.stderr.write(f"Could not open p4k file {p4k_file}\n")
+            sys.exit(1)
+
+        p = p4k.P4KFile(p4k_file, index_cache=True)
+        members = [p.getinfo(name) for name in p.search(file_filter.strip("'").strip('"'))]
+        sys.stderr.write(f"Hashing {len(members)} files using {algorithm}\n")
+        m = build_manifest(p, members, algorithm=algorithm, workers=workers, use_processes=processes,
+                           on_error=lambda name, error: sys.stderr.write(f"ERROR {name}: {error}\n"))
+
+        if output == "-":
+            m.save(sys.stdout)
+        else:
+            output = Path(output or f"{Path(p4k_file).stem}.p4kmanifest")
+            m.save(output)
+            sys.stderr.write(f"Saved manifest to {output}\n")
+        sys.stderr.write(f"Hashed {len(m.digests)} files in {m.seconds:.2f}s ({m.mb_per_second:.1f} MB/s)\n")
+        if m.errors:
+            sys.stderr.write(f"{len(m.errors)} files could not be read\n")
+            sys.exit(2)
+
+    @command(help="Check that every file in a P4K can be decrypted and decompressed, optionally comparing their "
+                  "contents to a manifest")
+    @argument("p4k_file", description="P4K file to verify", positional=True)
+    @argument(
+        "manifest",
+        description="Manifest created with `p4k manifest` to compare the contents of the files to",
+        aliases=["-m"],
+    )
+    @argument(
+        "file_filter",
+        description="Posix style file filter of which files to verify. Defaults to '*'",
+        aliases=["-f"],
+    )
+    @argument("workers", description="Number of workers. Defaults to one per CPU", aliases=["-j"])
+    @argument("processes", description="Use worker processes instead of threads")
+    def verify(self, p4k_file: typing.Text, manifest: typing.Text = "", file_filter: typing.Text = "*",
+               workers: int = 0, processes: bool = False):
+        if not Path(p4k_file).is_file():
+            sys.stderr.write(f"Could not open p4k file {p4k_file}\n")
+            sys.exit(1)
+
+        file_filter = file_filter.strip("'").strip('"')
+        reference = P4KManifest.load(manifest) if manifest else None
+        if reference is not None and file_filter != "*":
+            # only compare the files that match the filter, as files missing from the P4K can't be searched for
+            r = re.compile(fnmatch.translate(file_filter.replace("\\", "/")), flags=re.IGNORECASE)
+            reference.digests = {name: digest for name, digest in reference.digests.items() if r.match(name)}
+        p = p4k.P4KFile(p4k_file, index_cache=True)
+        members = [p.getinfo(name) for name in p.search(file_filter)]
+        print(f"Verifying {len(members)} files")
+        print("=" * 80)
+        m = build_manifest(p, members, algorithm=reference.algorithm if reference else DEFAULT_DIGEST_ALGORITHM,
+                           workers=workers, use_processes=processes,
+                           on_error=lambda name, error: print(f"E {name}: {error}"))
+
+        failed = bool(m.errors)
+        if reference is not None:
+            d = m.compare(reference)
+            for status, names in (("A", d.added), ("D", d.removed), ("M", d.changed)):
+                for name in sorted(names):
+                    print(f"{status} {name}")
+            failed |= bool(d)
+        print("=" * 80)
+        print(f"Verified {len(m.digests)} files in {m.seconds:.2f}s ({m.mb_per_second:.1f} MB/s), "
+              f"{len(m.errors)} could not be read")
+        if reference is not None:
+            print(f"{len(d.added)} not in manifest, {len(d.removed)} missing, {len(d.changed)} differ from manifest, "
+                  f"{d.unchanged} match")
+        if failed:
+            sys.exit(2)
@@ -9,21 +9,34 @@ References:
 
 __all__ = [
     "CryXMLBParser",
+    "CryXMLBStringCache",
+    "DEFAULT_STRING_CACHE",
     "pprint_xml_tree",
     "etree_from_cryxml_file",
     "dict_from_cryxml_file",
+    "json_from_cryxml_file",
+    "iterparse_cryxml",
 ]
 
+import io
+import os
+import sys
+import json
+import mmap
+import functools
+from json.encoder import encode_basestring_ascii
 from ctypes import sizeof
 from xml.etree import ElementTree
 from xml.etree.ElementTree import TreeBuilder, ParseError, XMLParser
 
+import numpy as np
+
 from scdatatools.cryxml.utils import pprint_xml_tree
 from scdatatools.cryxml.defs import (
     CryXMLBHeader,
-    CryXMLBNodeIndex,
-    CryXMLBNode,
-    CryXMLBAttribute,
+    CRYXMLB_NODE_DTYPE,
+    CRYXMLB_ATTRIBUTE_DTYPE,
+    CRYXMLB_NODE_INDEX_DTYPE,
     CRYXML_NO_PARENT,
 )
 from scdatatools.utils import etree_to_dict
@@ -33,11 +46,73 @@ class _StandardXmlFile(Exception):
     pass
 
 
+def _as_buffer(source):
+    """ Returns `source` as a buffer the parser can read in place, or `None` if it does not support the buffer
+    protocol """
+    if isinstance(source, (bytes, bytearray, mmap.mmap)):
+        return source
+    try:
+        view = memoryview(source)
+    except TypeError:
+        return None
+    return view.cast("B") if view.c_contiguous else view.tobytes()
+
+
+def _element_tag(tag):
+    # tags are named the way :class:`CryXMLBParser` gives them to its target
+    return "{" + tag if "}" in tag else tag
+
+
+class CryXMLBStringCache:
+    """ Cache of the decoded strings of CryXMLB files, shared between all the files parsed in a process as CIG's files
+    have most of their tags, attribute names and many values in common. Strings are cached by their raw bytes, so
+    strings that were seen before are not decoded again, and decoded strings are interned, so every occurrence of a
+    string in the parsed trees is the same object.
+
+    The cache is cleared once the raw and decoded strings it holds take up more than `max_bytes`, so files with many
+    unique values can't grow it without bound. Parsers use :data:`DEFAULT_STRING_CACHE` unless given their own cache,
+    call its :meth:`clear` to release the memory once done parsing.
+
+    :param max_bytes: Memory budget of the cache
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._strings = {}
+
+    def __len__(self):
+        return len(self._strings)
+
+    def decode(self, raw: bytes, encoding="UTF-8") -> str:
+        """ Returns the decoded, interned, string of `raw` """
+        key = (raw, encoding)
+        s = self._strings.get(key)
+        if s is None:
+            s = sys.intern(raw.decode(encoding))
+            size = sys.getsizeof(raw) + sys.getsizeof(s)
+            if self.size + size > self.max_bytes:
+                self.clear()
+            self._strings[key] = s
+            self.size += size
+        return s
+
+    def clear(self):
+        """ Remove every cached string """
+        self._strings.clear()
+        self.size = 0
+
+
+# String cache used by parsers that are not given their own
+DEFAULT_STRING_CACHE = CryXMLBStringCache()
+
+
 class _CryXMLBParser:
     """ Parsers a CryXMLB file """
 
-    def __init__(self, target, encoding="UTF-8"):
+    def __init__(self, target, encoding="UTF-8", string_cache=None):
         self.target = target
+        self.string_cache = string_cache if string_cache is not None else DEFAULT_STRING_CACHE
 
         self.StartElementHandler = None
         self.EndElementHandler = None
@@ -51,96 +126,333 @@ class _CryXMLBParser:
         self._data = None
         self._header = None
 
-        self._nodes = []
-        self._attributes = []
+        # the node tables, decoded into lists so the tree can be walked without touching the file data
+        self._tags = []
+        self._element_tags = []
+        self._contents = []
+        self._attribute_keys = []
+        self._attribute_values = []
+        self._first_attributes = []
+        self._attribute_counts = []
+        self._first_children = []
+        self._child_counts = []
         self._child_indices = []
 
-    def _read_string(self, offset):
-        if self._header is None or self._data is None:
-            return None
-        offset = self._header.string_data_offset + offset
-        s = self._data[
-            offset : self._data.index(
-                b"\x00",
-                offset,
-                self._header.string_data_offset + self._header.string_data_size,
-            )
-        ]
-        return s.decode(self.encoding)
-
-    def _read_node(self, index):
-        if len(self._nodes) > index:
-            return self._nodes[index]
-        offset = self._header.node_table_offset + index * sizeof(CryXMLBNode)
-        node = CryXMLBNode.from_buffer(self._data, offset)
-        node.offset = offset
-        node.index = index
-        node.tag = self._read_string(node.tag_string_offset)
-        node.attributes = {
-            a.key: a.value
-            for i in range(
-                node.first_attribute_index,
-                node.first_attribute_index + node.attribute_count,
+    def _read_strings(self, offsets) -> dict:
+        """ Returns a dict of each of the `offsets` into the string table to the NUL terminated string there """
+        header = self._header
+        string_data = bytes(
+            self._data[header.string_data_offset:header.string_data_offset + header.string_data_size]
+        )
+        if len(string_data) != header.string_data_size:
+            raise ValueError("String data extends past the end of the file")
+
+        # split the whole string table at once, the strings are referenced from their start
+        decode = self.string_cache.decode
+        encoding = self.encoding
+        strings = {}
+        start = 0
+        for raw in string_data.split(b"\x00")[:-1]:
+            strings[start] = decode(raw, encoding)
+            start += len(raw) + 1
+
+        # any offsets into the middle of a string (the writer may share the suffix of a string)
+        offsets = np.unique(offsets)
+        offsets = offsets[~np.isin(offsets, np.fromiter(strings, dtype=np.int64, count=len(strings)))]
+        if len(offsets):
+            ends = np.flatnonzero(np.frombuffer(string_data, dtype=np.uint8) == 0)
+            stops = np.searchsorted(ends, offsets)
+            if stops[-1] >= len(ends):
+                raise ValueError("String offset is outside of the string data")
+            for start, end in zip(offsets.tolist(), ends[stops].tolist()):
+                strings[start] = decode(string_data[start:end], encoding)
+        return strings
+
+    def _map_tables(self):
+        """ Returns the node, attribute and child tables as arrays over the file data, without copying them """
+        header = self._header
+        nodes = np.frombuffer(
+            self._data, dtype=CRYXMLB_NODE_DTYPE, count=header.node_count, offset=header.node_table_offset
+        )
+        attributes = np.frombuffer(
+            self._data,
+            dtype=CRYXMLB_ATTRIBUTE_DTYPE,
+            count=header.attributes_count,
+            offset=header.attributes_table_offset,
+        )
+        child_indices = np.frombuffer(
+            self._data,
+            dtype=CRYXMLB_NODE_INDEX_DTYPE,
+            count=header.child_table_count,
+            offset=header.child_table_offset,
+        )
+        return nodes, attributes, child_indices
+
+    def _read_tables(self):
+        """ Decode the node, attribute and child tables in bulk """
+        nodes, attributes, child_indices = self._map_tables()
+        strings = self._read_strings(
+            np.concatenate(
+                [
+                    nodes["tag_string_offset"],
+                    nodes["content_string_offset"],
+                    attributes["key_string_offset"],
+                    attributes["value_string_offset"],
+                ]
             )
-            if (a := self._read_attribute(i)) is not None
-        }
-        return node
-
-    def _read_attribute(self, index):
-        if len(self._attributes) > index:
-            return self._attributes[index]
-        offset = self._header.attributes_table_offset + index * sizeof(CryXMLBAttribute)
-        attrib = CryXMLBAttribute.from_buffer(self._data, offset)
-        attrib.key = self._read_string(attrib.key_string_offset)
-        attrib.value = self._read_string(attrib.value_string_offset)
-        return attrib
-
-    def _read_child_index(self, index):
-        if len(self._child_indices) > index:
-            return self._child_indices[index]
-        offset = self._header.child_table_offset + index * sizeof(CryXMLBNodeIndex)
-        return CryXMLBNodeIndex.from_buffer(self._data, offset)
-
-    def _iter_parse_nodes(self, node: CryXMLBNode):
-        self.StartElementHandler(node.tag, node.attributes)
-        content = self._read_string(node.content_string_offset)
-        if content:
-            self.CharacterDataHandler(content)
-
-        for i in range(
-            node.first_child_index, node.first_child_index + node.child_count
-        ):
-            self._iter_parse_nodes(self._read_node(self._read_child_index(i).index))
-
-        self.EndElementHandler(node.tag)
-
-    def Parse(self, data):
+        )
+        self._tags = [strings[o] for o in nodes["tag_string_offset"].tolist()]
+        self._element_tags = [_element_tag(tag) for tag in self._tags]
+        self._contents = [strings[o] for o in nodes["content_string_offset"].tolist()]
+        self._attribute_keys = [strings[o] for o in attributes["key_string_offset"].tolist()]
+        self._attribute_values = [strings[o] for o in attributes["value_string_offset"].tolist()]
+        self._first_attributes = nodes["first_attribute_index"].tolist()
+        self._attribute_counts = nodes["attribute_count"].tolist()
+        self._first_children = nodes["first_child_index"].tolist()
+        self._child_counts = nodes["child_count"].tolist()
+        self._child_indices = child_indices.tolist()
+        return nodes
+
+    def _attributes(self, index) -> dict:
+        first = self._first_attributes[index]
+        last = first + self._attribute_counts[index]
+        return dict(zip(self._attribute_keys[first:last], self._attribute_values[first:last]))
+
+    def _children(self, index) -> list:
+        first = self._first_children[index]
+        return self._child_indices[first:first + self._child_counts[index]]
+
+    def _walk(self, children):
+        """ Yields `(True, index)` as each node starts and `(False, index)` as it ends, in document order, where
+        `children(index)` returns the child indices of node `index`. The tree is walked with an explicit stack, so
+        deep files are not limited by the recursion limit. """
+        max_depth = self._header.node_count
+        yield True, 0
+        path = [0]
+        stack = [iter(children(0))]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                yield False, path.pop()
+                continue
+            if len(stack) >= max_depth:
+                raise ValueError("CryXmlB node tree contains a cycle")
+            yield True, child
+            path.append(child)
+            stack.append(iter(children(child)))
+
+    def _load(self, data, lazy=False):
+        """ Read the header and tables of the CryXMLB file `data`. Raises :class:`_StandardXmlFile` if `data` is a
+        text XML file instead.
+
+        If `lazy`, the tables are only mapped and strings are decoded as they are used, see :meth:`_string`.
+        """
         if len(data) < sizeof(CryXMLBHeader):
             raise ValueError("File is not a binary XML file (file size is too small).")
 
         self._data = data
-        self._header = CryXMLBHeader.from_buffer(data, 0)
+        self._header = CryXMLBHeader.from_buffer_copy(data[:sizeof(CryXMLBHeader)])
 
         # TODO: actually do header validation - see references
         if self._header.signature != b"CryXmlB":
             if self._header.signature.startswith(b"<"):
-                # try parsing as a normal xml file
-                parser = XMLParser(target=self.target)
-                parser.feed(self._data)
                 raise _StandardXmlFile()
             raise ParseError("Invalid CryXmlB Signature")
 
-        self._attributes = [
-            self._read_attribute(i) for i in range(self._header.attributes_count)
-        ]
-        self._child_indices = [
-            self._read_child_index(i) for i in range(self._header.child_table_count)
-        ]
-        self._nodes = [self._read_node(i) for i in range(self._header.node_count)]
+        if lazy:
+            self._node_table, self._attribute_table, self._child_table = self._map_tables()
+            self._strings = {}
+            self._string_data = data
+            self._string_data_offset = self._header.string_data_offset
+            if not hasattr(data, "find"):
+                # a memoryview, search a copy of just the string table
+                self._string_data = bytes(data[self._string_data_offset:
+                                               self._string_data_offset + self._header.string_data_size])
+                self._string_data_offset = 0
+            nodes = self._node_table
+        else:
+            nodes = self._read_tables()
+        if not len(nodes):
+            raise ValueError("CryXmlB file has no nodes")
+        assert nodes[0]["parent_index"] == CRYXML_NO_PARENT
+
+    def _string(self, offset) -> str:
+        """ Returns the string at `offset` into the string table, for files loaded with `lazy` """
+        s = self._strings.get(offset)
+        if s is None:
+            start = self._string_data_offset + offset
+            end = self._string_data.find(b"\x00", start, self._string_data_offset + self._header.string_data_size)
+            if end < 0:
+                raise ValueError("String offset is outside of the string data")
+            s = self._strings[offset] = self.string_cache.decode(bytes(self._string_data[start:end]), self.encoding)
+        return s
+
+    def _lazy_children(self, index) -> list:
+        _, _, _, child_count, _, _, first_child, _ = self._node_table[index].item()
+        return self._child_table[first_child:first_child + child_count].tolist()
+
+    def _lazy_element(self, index) -> ElementTree.Element:
+        tag, content, attribute_count, _, _, first_attribute, _, _ = self._node_table[index].item()
+        string = self._string
+        attributes = self._attribute_table[first_attribute:first_attribute + attribute_count].tolist()
+        element = ElementTree.Element(_element_tag(string(tag)), {string(k): string(v) for k, v in attributes})
+        element.text = string(content) or None
+        return element
 
-        root_node = self._read_node(0)
-        assert root_node.parent_index == CRYXML_NO_PARENT
-        self._iter_parse_nodes(root_node)
+    def Parse(self, data):
+        try:
+            self._load(data)
+        except _StandardXmlFile:
+            # try parsing as a normal xml file
+            parser = XMLParser(target=self.target)
+            parser.feed(data)
+            raise
+
+        tags = self._tags
+        contents = self._contents
+        for start, index in self._walk(self._children):
+            if start:
+                self.StartElementHandler(tags[index], self._attributes(index))
+                if contents[index]:
+                    self.CharacterDataHandler(contents[index])
+            else:
+                self.EndElementHandler(tags[index])
+
+    def _members(self, index) -> dict:
+        """ Returns the members of the dict of node `index`, as they are given by :func:`etree_to_dict`, with each
+        child tag mapped to a list of the child node indices and attributes and text mapped to their values. """
+        members = {}
+        tags = self._element_tags
+        for child in self._children(index):
+            tag = tags[child]
+            if tag in members:
+                members[tag].append(child)
+            else:
+                members[tag] = [child]
+        first = self._first_attributes[index]
+        last = first + self._attribute_counts[index]
+        for key, value in zip(self._attribute_keys[first:last], self._attribute_values[first:last]):
+            members["@" + key] = value
+        if members:
+            text = self._contents[index].strip()
+            if text:
+                members["#text"] = text
+        return members
+
+    def _leaf_json(self, index):
+        """ Returns the JSON of node `index` if it has no children or attributes, otherwise `None` """
+        if self._child_counts[index] or self._attribute_counts[index]:
+            return None
+        return encode_basestring_ascii(self._contents[index].strip()) if self._contents[index] else "{}"
+
+    def to_dict(self) -> dict:
+        """ Returns the loaded file as a dict, identical to :func:`etree_to_dict` of its ElementTree """
+        node_count = self._header.node_count
+        contents = self._contents
+
+        # walk the tree with an explicit stack, listing each node after its parent
+        nodes = []
+        stack = [0]
+        while stack:
+            index = stack.pop()
+            members = self._members(index)
+            nodes.append((index, members))
+            for v in members.values():
+                if type(v) is list:
+                    stack.extend(v)
+            if len(nodes) > node_count:
+                raise ValueError("CryXmlB node tree contains a cycle or shared nodes")
+
+        # then fill in the values of the nodes in reverse, so the values of a node's children are already known
+        values = [None] * len(contents)
+        for index, members in reversed(nodes):
+            if not members:
+                values[index] = contents[index].strip() if contents[index] else {}
+                continue
+            for key, v in members.items():
+                if type(v) is list:
+                    members[key] = values[v[0]] if len(v) == 1 else [values[child] for child in v]
+            values[index] = members
+        return {self._element_tags[0]: values[0]}
+
+    def _json_items(self, index, level, sort_keys, item_separator, newline) -> list:
+        """ Returns the JSON of node `index` at nesting `level`, as a list of strings and the `(index, level)` of the
+        child nodes to write in their place """
+        members = self._members(index)
+        if not members:
+            return [self._leaf_json(index)]
+
+        items = []
+        text = []
+        leaf_json = self._leaf_json
+        member_newline = newline(level + 1)
+        list_newline = newline(level + 2)
+        separator = "{"
+        for key, v in sorted(members.items()) if sort_keys else members.items():
+            text.append(separator + member_newline + encode_basestring_ascii(key) + ": ")
+            separator = item_separator
+            if type(v) is not list:
+                text.append(encode_basestring_ascii(v))
+            elif len(v) == 1:
+                leaf = leaf_json(v[0])
+                if leaf is not None:
+                    text.append(leaf)
+                else:
+                    items.append("".join(text))
+                    text.clear()
+                    items.append((v[0], level + 1))
+            else:
+                list_separator = "["
+                for child in v:
+                    text.append(list_separator + list_newline)
+                    list_separator = item_separator
+                    leaf = leaf_json(child)
+                    if leaf is not None:
+                        text.append(leaf)
+                    else:
+                        items.append("".join(text))
+                        text.clear()
+                        items.append((child, level + 2))
+                text.append(member_newline + "]")
+        text.append(newline(level) + "}")
+        items.append("".join(text))
+        return items
+
+    def write_json(self, fp, indent=4, sort_keys=False):
+        """ Write the loaded file to the text file object `fp` as JSON, identical to `json.dump` of :meth:`to_dict`
+        with the same `indent` and `sort_keys`, without creating the dict. Like :meth:`_walk`, the tree is walked with
+        an explicit stack. """
+        if indent is not None and not isinstance(indent, str):
+            indent = " " * indent
+        item_separator = "," if indent is not None else ", "
+        newlines = []
+
+        def newline(level):
+            if indent is None:
+                return ""
+            while len(newlines) <= level:
+                newlines.append("\n" + indent * len(newlines))
+            return newlines[level]
+
+        nodes_left = self._header.node_count
+        out = ["{" + newline(1) + encode_basestring_ascii(self._element_tags[0]) + ": "]
+        # the strings and nodes still to be written, in reverse
+        stack = [(0, 1)]
+        while stack:
+            item = stack.pop()
+            if type(item) is str:
+                out.append(item)
+                if len(out) > 4096:
+                    fp.write("".join(out))
+                    out.clear()
+                continue
+            nodes_left -= 1
+            if nodes_left < 0:
+                raise ValueError("CryXmlB node tree contains a cycle or shared nodes")
+            stack.extend(reversed(self._json_items(*item, sort_keys, item_separator, newline)))
+        out.append(newline(0) + "}")
+        fp.write("".join(out))
 
 
 class CryXMLBParser:
@@ -153,14 +465,21 @@ class CryXMLBParser:
 
         from xml.etree import ElementTree
         et = ElementTree.parse('path/to/sc_cryxml.xml', parser=CryXMLBParser())
+
+        # or parse the contents of a file in place, e.g. from P4KFile.read_bytes
+        root = CryXMLBParser().parse_buffer(data)
+
+    :param target: Target receiving the parse events, defaults to a :class:`TreeBuilder`
+    :param encoding: Encoding of the strings in the file
+    :param string_cache: :class:`CryXMLBStringCache` used to decode strings, defaults to one shared by every parser
     """
 
-    def __init__(self, *, target=None, encoding="UTF-8"):
+    def __init__(self, *, target=None, encoding="UTF-8", string_cache=None):
         if target is None:
             target = TreeBuilder()
 
-        self._data = bytearray()
-        self.parser = self._parser = _CryXMLBParser(target, encoding)
+        self._chunks = []
+        self.parser = self._parser = _CryXMLBParser(target, encoding, string_cache=string_cache)
         self.target = self._target = target
         self.target = target
         self.encoding = encoding
@@ -215,12 +534,24 @@ class CryXMLBParser:
 
     def feed(self, data):
         """Feed encoded data to parser."""
-        self._data.extend(data)
+        self._chunks.append(bytes(data))
+
+    def parse_buffer(self, data):
+        """ Parse the whole file `data`, any object supporting the buffer protocol (e.g. `bytes`, a `memoryview` or
+        an `mmap`), in place instead of feeding it to the parser. Returns the root element, like :meth:`close`. """
+        buffer = _as_buffer(data)
+        if buffer is None:
+            raise TypeError(f"a bytes-like object is required, not '{type(data).__name__}'")
+        return self._close(buffer)
 
     def close(self):
         """Finish feeding data to parser and return element structure."""
+        chunks, self._chunks = self._chunks, []
+        return self._close(chunks[0] if len(chunks) == 1 else b"".join(chunks))
+
+    def _close(self, data):
         try:
-            self.parser.Parse(self._data)
+            self.parser.Parse(data)
         except _StandardXmlFile:
             pass
         except self._error as v:
@@ -237,32 +568,152 @@ class CryXMLBParser:
             del self.target, self._target
 
 
-def is_cryxmlb_file(source):
-    loc = source.tell()
-    source.seek(0, 2)
-    if source.tell() < sizeof(CryXMLBHeader):
-        return False
+def is_cryxmlb_file(source) -> bool:
+    """ Returns `True` if `source` is a CryXMLB file.
 
-    source.seek(0)
-    header = CryXMLBHeader.from_buffer(source, 0)
-    source.seek(loc)
-    return header.signature == b"CryXmlB"
+    :param source: File name, file object or the contents of the file. File objects are checked from their start and
+        left at their current position.
+    """
+    buffer = _as_buffer(source)
+    if buffer is not None:
+        header = buffer[:sizeof(CryXMLBHeader)]
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            header = f.read(sizeof(CryXMLBHeader))
+    else:
+        loc = source.tell()
+        source.seek(0)
+        header = source.read(sizeof(CryXMLBHeader))
+        source.seek(loc)
+    return len(header) == sizeof(CryXMLBHeader) and CryXMLBHeader.from_buffer_copy(header).signature == b"CryXmlB"
 
 
 def etree_from_cryxml_file(source) -> ElementTree:
-    """ Convenience method that converts the file `source` to an ElementTree.
+    """ Convenience method that converts the file `source` to an ElementTree. Buffers are parsed in place, see
+    :meth:`CryXMLBParser.parse_buffer`.
 
-    :param source: File name or file object
+    :param source: File name, file object or the contents of the file
     """
-    return ElementTree.parse(source, parser=CryXMLBParser())
+    return ElementTree.ElementTree(CryXMLBParser().parse_buffer(_read_source(source)))
+
+
+def _read_source(source):
+    buffer = _as_buffer(source)
+    if buffer is not None:
+        return buffer
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    return source.read()
+
+
+def _load_cryxmlb(data) -> _CryXMLBParser:
+    """ Returns a parser with the CryXMLB file `data` loaded, for converting it without an ElementTree. Raises
+    :class:`_StandardXmlFile` if `data` is a text XML file. """
+    parser = _CryXMLBParser(None)
+    try:
+        parser._load(data)
+    except ValueError as e:
+        raise ParseError(e)
+    return parser
 
 
 def dict_from_cryxml_file(source) -> dict:
-    """ Convenience method that converts the file `source` to an ElementTree.
+    """ Convenience method that converts the file `source` to a dict, following the XML to JSON specification of
+    :func:`etree_to_dict`. CryXMLB files are converted directly from their tables, without building an
+    ElementTree.
+
+    :param source: File name, file object or the contents of the file
+    """
+    data = _read_source(source)
+    try:
+        parser = _load_cryxmlb(data)
+    except _StandardXmlFile:
+        return etree_to_dict(etree_from_cryxml_file(data))
+    try:
+        return parser.to_dict()
+    except ValueError as e:
+        raise ParseError(e)
+
+
+def json_from_cryxml_file(source, output=None, indent=4, sort_keys=False):
+    """ Convenience method that converts the file `source` to JSON, the same as `json.dump` of
+    :func:`dict_from_cryxml_file`. CryXMLB files are written as they are walked, without creating the dict.
+
+    :param source: File name, file object or the contents of the file
+    :param output: File name or text file object to write the JSON to. If `None` the JSON is returned as a string
+    :param indent: Passed to `json.dump`
+    :param sort_keys: Passed to `json.dump`
+    """
+    data = _read_source(source)
+    try:
+        parser = _load_cryxmlb(data)
+        write = parser.write_json
+    except _StandardXmlFile:
+        d = etree_to_dict(etree_from_cryxml_file(data))
+        write = functools.partial(json.dump, d)
+
+    # the output is only opened once the source has been parsed, so nothing is written for invalid files
+    try:
+        if output is None:
+            with io.StringIO() as f:
+                write(f, indent=indent, sort_keys=sort_keys)
+                return f.getvalue()
+        if isinstance(output, (str, os.PathLike)):
+            with open(output, "w") as f:
+                write(f, indent=indent, sort_keys=sort_keys)
+        else:
+            write(output, indent=indent, sort_keys=sort_keys)
+    except ValueError as e:
+        # a malformed node tree found while walking it
+        raise ParseError(e)
+
+
+def iterparse_cryxml(source, events=None, string_cache=None):
+    """ Incrementally parse the file `source`, the same as :func:`ElementTree.iterparse`. Returns an iterator of
+    `(event, element)` pairs, the elements are added to their parent as they start.
+
+    CryXMLB files are walked straight from their tables, only the nodes that are reached are turned into elements
+    and only their strings are decoded. Stop iterating once the part of the file that is needed has been read, and
+    `clear()` finished elements (or remove them from their parent) to keep memory use constant.
 
-    :param source: File name or file object
+    :param source: File name, file object or the contents of the file
+    :param events: Events to report, any of `"start"` and `"end"`. Defaults to `("end",)`
+    :param string_cache: :class:`CryXMLBStringCache` used to decode strings, defaults to one shared by every parser
     """
-    return etree_to_dict(etree_from_cryxml_file(source))
+    events = ("end",) if events is None else tuple(events)
+    for event in events:
+        if event not in ("start", "end"):
+            raise ValueError(f"unknown event {event!r}")
+    report_start = "start" in events
+    report_end = "end" in events
+
+    data = _read_source(source)
+    parser = _CryXMLBParser(None, string_cache=string_cache)
+    try:
+        parser._load(data, lazy=True)
+    except _StandardXmlFile:
+        yield from ElementTree.iterparse(io.BytesIO(data), events)
+        return
+    except ValueError as e:
+        raise ParseError(e)
+
+    elements = []
+    try:
+        for start, index in parser._walk(parser._lazy_children):
+            if start:
+                element = parser._lazy_element(index)
+                if elements:
+                    elements[-1].append(element)
+                elements.append(element)
+                if report_start:
+                    yield "start", element
+            else:
+                element = elements.pop()
+                if report_end:
+                    yield "end", element
+    except ValueError as e:
+        raise ParseError(e)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,8 @@
 import ctypes
 from ctypes import LittleEndianStructure, sizeof
 
+import numpy as np
+
 
 class CryXMLBHeader(LittleEndianStructure):
     _fields_ = [
@@ -47,3 +49,28 @@ class CryXMLBAttribute(LittleEndianStructure):
 
 
 CRYXML_NO_PARENT = 0xFFFFFFFF
+
+
+# NumPy dtypes mirroring the structures above, used to decode the tables of a CryXMLB file in bulk
+
+CRYXMLB_NODE_INDEX_DTYPE = np.dtype("<u4")
+
+CRYXMLB_NODE_DTYPE = np.dtype(
+    [
+        ("tag_string_offset", "<u4"),
+        ("content_string_offset", "<u4"),
+        ("attribute_count", "<u2"),
+        ("child_count", "<u2"),
+        ("parent_index", "<u4"),
+        ("first_attribute_index", "<u4"),
+        ("first_child_index", "<u4"),
+        ("reserved", "V%d" % CryXMLBNode.reserved.size),
+    ]
+)
+
+CRYXMLB_ATTRIBUTE_DTYPE = np.dtype(
+    [
+        ("key_string_offset", "<u4"),
+        ("value_string_offset", "<u4"),
+    ]
+)
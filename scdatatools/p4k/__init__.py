@@ -0,0 +1,1593 @@
+import re
+import io
+import os
+import mmap
+import time
+import queue
+import shutil
+import struct
+import zipfile
+import fnmatch
+import functools
+import threading
+import contextlib
+import collections.abc
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import numpy as np
+import zstandard as zstd
+from Crypto.Cipher import AES
+
+from scdatatools.p4k.archive import ARCHIVE_FORMATS, write_archive
+from scdatatools.p4k.cache import ContentCache
+from scdatatools.p4k.convert import CryXMLConverter
+from scdatatools.p4k.dedupe import DEDUPE_MODES, group_duplicates, link_file, unlink_existing
+from scdatatools.p4k.manifest import ExtractManifest, DEFAULT_EXTRACT_MANIFEST
+from scdatatools.p4k.seek import ZstdSeekPoints, scan_zstd_frames
+from scdatatools.p4k.index import (
+    P4KIndex,
+    default_index_cache_path,
+    glob_to_regex,
+    index_cache_key,
+    literal_prefix,
+)
+
+
+ZIP_ZSTD = 100
+p4kFileHeader = b"PK\x03\x14"
+DEFAULT_P4K_KEY = b"\x5E\x7A\x20\x02\x30\x2E\xEB\x1A\x3B\xB6\x17\xC3\x0F\xDE\x1E\x47"
+
+compressor_names = zipfile.compressor_names
+compressor_names[100] = "zstd"
+
+# compression methods by name, as accepted by `P4KFile.query`
+COMPRESS_TYPES = {"stored": zipfile.ZIP_STORED, "zstd": ZIP_ZSTD}
+
+
+def _dos_date_time(d, t):
+    """ Convert a DOS date/time code to (year, month, day, hour, min, sec) """
+    return (
+        (d >> 9) + 1980,
+        (d >> 5) & 0xF,
+        d & 0x1F,
+        t >> 11,
+        (t >> 5) & 0x3F,
+        (t & 0x1F) * 2,
+    )
+
+
+def _P4KDecrypter(key, iv=b"\x00" * 16):
+    cipher = AES.new(key, AES.MODE_CBC, iv)
+
+    def decrypter(data):
+        return cipher.decrypt(data)
+
+    return decrypter
+
+
+class ZStdDecompressor:
+    """ Incrementally decompresses the zstd data of a P4K entry, which may consist of several frames followed by the
+    zero padding of encrypted entries.
+
+    :param compressed_offset: Offset of the first frame within the entry's compressed data
+    :param uncompressed_offset: Offset of the first frame's data within the entry's uncompressed data
+    :param skip: Number of bytes to discard before the first frame
+    :param on_frame: Called with the `(uncompressed_offset, compressed_offset)` of every following frame
+    """
+
+    def __init__(self, compressed_offset=0, uncompressed_offset=0, skip=0, on_frame=None):
+        self._dctx = zstd.ZstdDecompressor()
+        self._decomp = self._dctx.decompressobj()
+        self._frame_offset = compressed_offset
+        self._frame_consumed = 0
+        self._uncompressed_offset = uncompressed_offset
+        self._skip = skip
+        self._on_frame = on_frame
+        self.eof = False
+
+    def decompress(self, data):
+        if self._skip:
+            skipped = len(data[:self._skip])
+            data = data[skipped:]
+            self._skip -= skipped
+
+        result = []
+        while data and not self.eof:
+            if self._decomp is None:
+                if not data.strip(b"\x00"):
+                    # padding after the last frame
+                    break
+                self._decomp = self._dctx.decompressobj()
+                if self._on_frame is not None:
+                    self._on_frame(self._uncompressed_offset, self._frame_offset)
+
+            try:
+                chunk = self._decomp.decompress(data)
+            except zstd.ZstdError:
+                self.eof = True
+                break
+            result.append(chunk)
+            self._uncompressed_offset += len(chunk)
+
+            if not self._decomp.eof:
+                self._frame_consumed += len(data)
+                break
+
+            # end of the frame, anything left over belongs to the next one
+            unused = self._decomp.unused_data
+            self._frame_offset += self._frame_consumed + len(data) - len(unused)
+            self._frame_consumed = 0
+            self._decomp = None
+            data = unused
+        return b"".join(result)
+
+
+def _zstd_decompress_into(data, out) -> int:
+    """ Decompress the zstd frame in `data` directly into the writable memoryview `out`. Returns the number of bytes
+    written. """
+    pos = 0
+    with zstd.ZstdDecompressor().stream_reader(data, read_across_frames=True) as reader:
+        try:
+            while pos < len(out):
+                read = reader.readinto(out[pos:])
+                if not read:
+                    break
+                pos += read
+        except zstd.ZstdError:
+            # trailing data after the zstd frame, see `ZStdDecompressor`
+            pass
+    return pos
+
+
+class P4KExtFile(zipfile.ZipExtFile):
+    MIN_READ_SIZE = 65536
+
+    def __init__(self, fileobj, mode, p4kinfo, decrypter=None, close_fileobj=False, key=None, seek_points=None):
+        """
+        :param key: AES key of encrypted entries, required to seek within them
+        :param seek_points: :class:`ZstdSeekPoints` of the entry, used to seek to the nearest frame instead of
+            decompressing from the start of the entry. Frames are added to it as they are read.
+        """
+        self._is_encrypted = p4kinfo.is_encrypted
+        self._seek_points = seek_points if seek_points is not None else ZstdSeekPoints()
+        self._decompressor = ZStdDecompressor(on_frame=self._seek_points.add)
+
+        self._fileobj = fileobj
+        self._decrypter = decrypter
+        self._key = key
+        self._close_fileobj = close_fileobj
+
+        self._compress_type = p4kinfo.compress_type
+        self._compress_left = p4kinfo.compress_size
+        self._left = p4kinfo.file_size
+
+        self._eof = False
+        self._readbuffer = b""
+        self._offset = 0
+
+        self.newlines = None
+
+        self.mode = mode
+        self.name = p4kinfo.filename
+
+        if hasattr(p4kinfo, 'CRC'):
+            self._expected_crc = p4kinfo.CRC
+            self._running_crc = zipfile.crc32(b'')
+        else:
+            self._expected_crc = None
+        # TODO: the CRCs don't match, but im getting the same outputs as unp4k - we should figure out what exactly is
+        #   going into calculating the CRC for P4K entry
+        self._expected_crc = None
+
+        self._seekable = False
+        try:
+            if fileobj.seekable():
+                self._orig_compress_start = fileobj.tell()
+                self._orig_compress_size = p4kinfo.compress_size
+                self._orig_file_size = p4kinfo.file_size
+                self._orig_start_crc = self._running_crc
+                self._seekable = True
+        except AttributeError:
+            pass
+
+    def _read2(self, n):
+        if self._decrypter is not None:
+            # CBC decryption only works on whole blocks
+            n += -n % AES.block_size
+        return super()._read2(n)
+
+    def _restart(self, uncompressed_offset, compressed_offset):
+        """ Reposition the stream at `compressed_offset`, the start of a zstd frame (or any offset of a stored
+        entry), which holds the data at `uncompressed_offset` """
+        start = compressed_offset
+        if self._decrypter is not None:
+            # with CBC, decryption can start at any block by using the previous block as the IV
+            start -= start % AES.block_size
+            iv = b"\x00" * AES.block_size
+            if start:
+                self._fileobj.seek(self._orig_compress_start + start - AES.block_size)
+                iv = self._fileobj.read(AES.block_size)
+            self._decrypter = _P4KDecrypter(self._key, iv)
+        self._fileobj.seek(self._orig_compress_start + start)
+
+        self._compress_left = self._orig_compress_size - start
+        self._left = self._orig_file_size - uncompressed_offset
+        self._readbuffer = b""
+        self._offset = 0
+        self._eof = False
+        self._decompressor = ZStdDecompressor(compressed_offset, uncompressed_offset, skip=compressed_offset - start,
+                                              on_frame=self._seek_points.add)
+
+    def seek(self, offset, whence=0):
+        if self.closed:
+            raise ValueError("seek on closed file.")
+        if not self._seekable:
+            raise io.UnsupportedOperation("underlying stream is not seekable")
+        if self._decrypter is not None and self._key is None:
+            return super().seek(offset, whence)
+
+        curr_pos = self.tell()
+        if whence == 0:
+            new_pos = offset
+        elif whence == 1:
+            new_pos = curr_pos + offset
+        elif whence == 2:
+            new_pos = self._orig_file_size + offset
+        else:
+            raise ValueError("whence must be os.SEEK_SET (0), os.SEEK_CUR (1), or os.SEEK_END (2)")
+        new_pos = max(0, min(new_pos, self._orig_file_size))
+
+        buffer_start = curr_pos - self._offset
+        if not buffer_start <= new_pos < buffer_start + len(self._readbuffer):
+            if self._compress_type == zipfile.ZIP_STORED:
+                # stored data can be restarted anywhere (on a block boundary if encrypted)
+                point = new_pos - new_pos % AES.block_size if self._decrypter is not None else new_pos
+                point = (point, point)
+            else:
+                point = self._seek_points.find(new_pos)
+            # restart unless reading forward from the current position is closer
+            if new_pos < curr_pos or point[0] > curr_pos:
+                self._restart(*point)
+        return super().seek(new_pos)
+
+
+class P4KInfo(zipfile.ZipInfo):
+    def __init__(self, *args, **kwargs):
+        # ensure posix file paths as specified by the Zip format
+        super().__init__(*args, **kwargs)
+        self.filename = self.filename.replace('\\', "/")
+        self.is_encrypted = False
+        # offset of the data past the local file header, `None` until it has been read from the header
+        self._data_offset = None
+
+    @classmethod
+    def _from_index_entry(cls, name, entry):
+        """ Create a :class:`P4KInfo` from the original `name` and the `entry` tuple of a
+        :data:`~scdatatools.p4k.index.P4K_INDEX_DTYPE` record """
+        x = cls(name)
+        (
+            x.header_offset,
+            x.compress_size,
+            x.file_size,
+            x.CRC,
+            x.compress_type,
+            x.flag_bits,
+            t,
+            d,
+            x.create_version,
+            x.create_system,
+            x.extract_version,
+            x.reserved,
+            x.volume,
+            x.internal_attr,
+            x.external_attr,
+            x.is_encrypted,
+            data_offset,
+        ) = entry
+        x._data_offset = data_offset or None
+        # Convert date/time code to (year, month, day, hour, min, sec)
+        x._raw_time = t
+        x.date_time = _dos_date_time(d, t)
+        return x
+
+    def _decodeExtra(self):
+        # Try to decode the extra field.
+        extra = self.extra
+        unpack = struct.unpack
+
+        self.is_encrypted = len(self.extra) >= 168 and self.extra[168] > 0x00
+
+        # The following is the default ZipInfo decode, minus a few steps that would mark an encrypted it as invalid
+        # TODO: only do this if self.is_encrypted, otherwise call super?
+
+        while len(extra) >= 4:
+            tp, ln = unpack("<HH", extra[:4])
+            if tp == 0x0001:
+                if ln >= 24:
+                    counts = unpack("<QQQ", extra[4:28])
+                elif ln == 16:
+                    counts = unpack("<QQ", extra[4:20])
+                elif ln == 8:
+                    counts = unpack("<Q", extra[4:12])
+                elif ln == 0:
+                    counts = ()
+                else:
+                    raise zipfile.BadZipFile(
+                        "Corrupt extra field %04x (size=%d)" % (tp, ln)
+                    )
+
+                idx = 0
+
+                # ZIP64 extension (large files and/or large archives)
+                if self.file_size in (0xFFFFFFFFFFFFFFFF, 0xFFFFFFFF):
+                    self.file_size = counts[idx]
+                    idx += 1
+
+                if self.compress_size == 0xFFFFFFFF:
+                    self.compress_size = counts[idx]
+                    idx += 1
+
+                if self.header_offset == 0xFFFFFFFF:
+                    old = self.header_offset
+                    self.header_offset = counts[idx]
+                    idx += 1
+            extra = extra[ln + 4 :]
+
+
+def _check_local_header(fheader, fname, zinfo):
+    """ Validate the unpacked local file header `fheader` and raw file name `fname` read for `zinfo` """
+    if (
+        fheader[zipfile._FH_SIGNATURE] != p4kFileHeader
+        and fheader[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader
+    ):
+        raise zipfile.BadZipFile("Bad magic number for file header")
+
+    if zinfo.flag_bits & 0x20:
+        # Zip 2.7: compressed patched data
+        raise NotImplementedError("compressed patched data (flag bit 5)")
+
+    if zinfo.flag_bits & 0x40:
+        # strong encryption
+        raise NotImplementedError("strong encryption (flag bit 6)")
+
+    if zinfo.flag_bits & 0x800:
+        # UTF-8 filename
+        fname_str = bytes(fname).decode("utf-8")
+    else:
+        fname_str = bytes(fname).decode("cp437")
+
+    if fname_str != zinfo.orig_filename:
+        raise zipfile.BadZipFile(
+            "File name in directory %r and header %r differ."
+            % (zinfo.orig_filename, fname)
+        )
+
+
+def _checked_data_offset(zinfo, data_offset):
+    """ Record `data_offset`, read from the local file header of `zinfo`, raising `BadZipFile` if it differs from the
+    offset that was already known """
+    if zinfo._data_offset is not None and zinfo._data_offset != data_offset:
+        raise zipfile.BadZipFile(
+            "Data offset of %r in the index and its file header differ." % zinfo.orig_filename
+        )
+    zinfo._data_offset = data_offset
+    return data_offset
+
+
+def _local_data_offset(buf, zinfo, base=0, verify=False):
+    """ Returns the offset of the data of `zinfo` within `buf`, a buffer of the P4K file starting at offset `base`.
+    The local file header is only read if the data offset of `zinfo` is not yet known, or `verify` is set. """
+    if zinfo._data_offset is not None and not verify:
+        return zinfo._data_offset - base
+    offset = zinfo.header_offset - base
+    fheader = buf[offset:offset + zipfile.sizeFileHeader]
+    if len(fheader) != zipfile.sizeFileHeader:
+        raise zipfile.BadZipFile("Truncated file header")
+    fheader = struct.unpack(zipfile.structFileHeader, fheader)
+    offset += zipfile.sizeFileHeader
+    _check_local_header(fheader, buf[offset:offset + fheader[zipfile._FH_FILENAME_LENGTH]], zinfo)
+    offset += fheader[zipfile._FH_FILENAME_LENGTH] + fheader[zipfile._FH_EXTRA_FIELD_LENGTH]
+    return _checked_data_offset(zinfo, offset + base) - base
+
+
+def _read_local_header(fileobj, zinfo) -> int:
+    """ Read and validate the local file header of `zinfo` from `fileobj`, which must be positioned at the start of
+    it. Returns the offset of the member's data, where `fileobj` is left positioned. """
+    fheader = fileobj.read(zipfile.sizeFileHeader)
+    if len(fheader) != zipfile.sizeFileHeader:
+        raise zipfile.BadZipFile("Truncated file header")
+    fheader = struct.unpack(zipfile.structFileHeader, fheader)
+
+    fname = fileobj.read(fheader[zipfile._FH_FILENAME_LENGTH])
+    if fheader[zipfile._FH_EXTRA_FIELD_LENGTH]:
+        fileobj.seek(fheader[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+    _check_local_header(fheader, fname, zinfo)
+    return _checked_data_offset(
+        zinfo,
+        zinfo.header_offset + zipfile.sizeFileHeader + fheader[zipfile._FH_FILENAME_LENGTH]
+        + fheader[zipfile._FH_EXTRA_FIELD_LENGTH]
+    )
+
+
+def _open_member(fileobj, zinfo, key, mode="r", close_fileobj=False, seek_points=None, at_data=False):
+    """ Return a :class:`P4KExtFile` for `zinfo`, `fileobj` must be positioned at the start of the member's local
+    file header, or at the start of its data if `at_data` is set. """
+    if not at_data:
+        _read_local_header(fileobj, zinfo)
+
+    zd = None
+    if key and zinfo.is_encrypted:
+        zd = _P4KDecrypter(key)
+
+    return P4KExtFile(fileobj, mode, zinfo, zd, close_fileobj, key=key, seek_points=seek_points)
+
+
+def _read_member_payload(fileobj, zinfo, verify=False) -> bytes:
+    """ Read the raw (possibly encrypted and compressed) data of `zinfo` from `fileobj`. The local file header is only
+    read if the data offset of `zinfo` is not yet known, or `verify` is set. """
+    if zinfo._data_offset is not None and not verify:
+        fileobj.seek(zinfo._data_offset)
+    else:
+        fileobj.seek(zinfo.header_offset)
+        _read_local_header(fileobj, zinfo)
+    payload = fileobj.read(zinfo.compress_size)
+    if len(payload) != zinfo.compress_size:
+        raise EOFError
+    return payload
+
+
+class _PayloadReader:
+    """ File-like reader over the raw payload of a member at `buf[start:end]`, decrypting it as it is read if
+    `decrypter` is given. Every read copies from `buf`, so no view of it is held between reads. """
+
+    def __init__(self, buf, start, end, decrypter=None):
+        self._buf = buf
+        self._pos = start
+        self._end = end
+        self._decrypter = decrypter
+
+    def read(self, n=-1):
+        if n < 0:
+            n = self._end - self._pos
+        elif self._decrypter is not None:
+            # CBC decryption only works on whole blocks
+            n += -n % AES.block_size
+        data = self._buf[self._pos:min(self._pos + n, self._end)]
+        self._pos += len(data)
+        return self._decrypter(data) if self._decrypter is not None else bytes(data)
+
+
+def _decode_payload(zinfo, payload, key) -> bytes:
+    """ Decrypt and decompress the raw `payload` of `zinfo` in a single call """
+    if zinfo.file_size == 0:
+        return b""
+    if key and zinfo.is_encrypted:
+        payload = _P4KDecrypter(key)(payload)
+    if zinfo.compress_type == zipfile.ZIP_STORED:
+        return bytes(payload[:zinfo.file_size])
+    data = zstd.ZstdDecompressor().decompress(payload, max_output_size=zinfo.file_size)
+    if len(data) < zinfo.file_size:
+        # the entry is made up of multiple frames
+        data = ZStdDecompressor().decompress(bytes(payload))[:zinfo.file_size]
+    return data
+
+
+def _member_target_path(member, targetpath):
+    """ Returns the sanitized path `member` will be extracted to beneath `targetpath`. This mirrors the logic in
+    :meth:`zipfile.ZipFile._extract_member` """
+    arcname = member.filename.replace("/", os.path.sep)
+
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    # interpret absolute pathname as relative, remove drive letter or
+    # UNC path, redundant separators, "." and ".." components.
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_path_parts = ("", os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep) if x not in invalid_path_parts)
+    if os.path.sep == "\\":
+        # filter illegal characters on Windows
+        arcname = zipfile.ZipFile._sanitize_windows_name(arcname, os.path.sep)
+
+    return os.path.normpath(os.path.join(targetpath, arcname))
+
+
+def _extract_member_to(member, targetpath, opener=None, data=None, converter=None):
+    """ Extract the :class:`P4KInfo` `member` beneath `targetpath`. Its contents are either the already decompressed
+    `data`, or are read from the file object returned by the callable `opener`. CryXmlB files are also passed to the
+    :class:`CryXMLConverter` `converter`, if given, to be converted to JSON. Returns the path of the extracted
+    file. """
+    # TODO: handle not overwriting existing files flag?
+
+    # TODO: change this to use python logging so it can be easily shut off
+    print(
+        f"{compressor_names[member.compress_type]} | "
+        f'{"Crypt" if member.is_encrypted else "Plain"} | {member.filename}'
+    )
+    targetpath = _member_target_path(member, targetpath)
+
+    # Create all upper directories if necessary.
+    upperdirs = os.path.dirname(targetpath)
+    if upperdirs:
+        os.makedirs(upperdirs, exist_ok=True)
+
+    if member.is_dir():
+        if not os.path.isdir(targetpath):
+            os.mkdir(targetpath)
+        return targetpath
+
+    if data is None and converter is not None and member.filename.lower().endswith("xml"):
+        # read the file into memory so it can be converted without reading it back from disk
+        with opener(member) as source:
+            data = source.read()
+
+    # replace rather than overwrite the file, it may be linked to other files by a previous deduplicated extraction
+    unlink_existing(targetpath)
+    if data is not None:
+        with open(targetpath, "wb") as target:
+            target.write(data)
+        if converter is not None:
+            converter.submit(member, data, targetpath)
+    else:
+        with opener(member) as source, open(targetpath, "wb") as target:
+            shutil.copyfileobj(source, target)
+
+    return targetpath
+
+
+def _link_duplicates(duplicates, targetpath, mode, convert_cryxml=False, on_linked=None):
+    """ Materialize the `(member, original)` pairs from :func:`group_duplicates` beneath `targetpath` by linking each
+    member to its already extracted original, and print how many bytes this saved. `on_linked(member, original,
+    symlinked)` is called for each linked member. """
+    linked = saved = 0
+    for member, original in duplicates:
+        print(f"{compressor_names[member.compress_type]} | {mode.capitalize()} | {member.filename}")
+        src = _member_target_path(original, targetpath)
+        dst = _member_target_path(member, targetpath)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        symlinked = False
+        if link_file(src, dst, mode):
+            linked += 1
+            saved += member.file_size
+            symlinked = mode == "symlink"
+        if convert_cryxml and member.filename.lower().endswith("xml") and os.path.isfile(src[:-3] + "json"):
+            link_file(src[:-3] + "json", dst[:-3] + "json", mode)
+        if on_linked is not None:
+            on_linked(member, original, symlinked=symlinked)
+
+    print(f"Deduplicated {len(duplicates)} files: {linked} {mode}s created, {saved} bytes saved")
+    if linked != len(duplicates):
+        print(f"{len(duplicates) - linked} files were copied as {mode}s are not supported by the filesystem")
+
+
+# members are read in spans of up to this many bytes, merging adjacent members into a single read
+_MAX_READ_SPAN = 8 * 1024 * 1024
+# largest gap between two members that is read (and discarded) to merge them into the same span
+_MAX_READ_GAP = 64 * 1024
+# allowance for the local file header's extra field, which is not recorded in the index
+_LOCAL_EXTRA_ESTIMATE = 256
+
+
+def _plan_read_spans(members, max_span=_MAX_READ_SPAN, max_gap=_MAX_READ_GAP) -> list:
+    """ Group `members`, sorted by `header_offset`, into `[start, end, members]` spans of the P4K that can each be read
+    with a single sequential read. Members larger than `max_span` are in a span of their own. """
+    spans = []
+    for member in members:
+        start = member.header_offset
+        if member._data_offset is not None:
+            end = member._data_offset + member.compress_size
+        else:
+            end = (start + zipfile.sizeFileHeader + len(member.orig_filename.encode("utf-8")) + _LOCAL_EXTRA_ESTIMATE
+                   + member.compress_size)
+        span = spans[-1] if spans else None
+        if span is not None and span[0] <= start <= span[1] + max_gap and end - span[0] <= max_span:
+            span[1] = max(span[1], end)
+            span[2].append(member)
+        else:
+            spans.append([start, end, [member]])
+    return spans
+
+
+def _advise(fp, offset, length, advice):
+    """ Give the OS an access pattern hint for a range of `fp`, where supported """
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fp.fileno(), offset, length, advice)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            pass
+
+
+def _iter_member_payloads(fp, members, read_large=True, max_span=_MAX_READ_SPAN):
+    """ Yields `(member, payload)` with the raw data of each of `members`, which should be sorted by `header_offset`.
+    Adjacent members are read from `fp` with a single read and the OS is asked to read ahead the next span while the
+    current one is being processed. If `read_large` is not set, the payload of members larger than `max_span` is
+    not read and `None` is yielded instead, so they can be streamed. """
+    spans = _plan_read_spans(members, max_span=max_span)
+    if spans:
+        _advise(fp, 0, 0, getattr(os, "POSIX_FADV_SEQUENTIAL", 0))
+    for i, (start, end, span_members) in enumerate(spans):
+        if i + 1 < len(spans):
+            _advise(fp, spans[i + 1][0], spans[i + 1][1] - spans[i + 1][0], getattr(os, "POSIX_FADV_WILLNEED", 0))
+
+        if len(span_members) == 1:
+            member = span_members[0]
+            if member.is_dir():
+                yield member, b""
+            elif member.compress_size > max_span and not read_large:
+                yield member, None
+            else:
+                yield member, _read_member_payload(fp, member)
+            continue
+
+        fp.seek(start)
+        buf = fp.read(end - start)
+        for member in span_members:
+            if member.is_dir():
+                yield member, b""
+                continue
+            offset = _local_data_offset(buf, member, base=start)
+            if offset + member.compress_size <= len(buf):
+                yield member, buf[offset:offset + member.compress_size]
+            else:
+                # the local extra field was larger than estimated
+                yield member, _read_member_payload(fp, member)
+
+
+def _extract_members_sequentially(fp, members, key, targetpath, opener, converter=None, on_extracted=None):
+    """ Extract `members` in the order they are stored in the P4K, reading adjacent members from `fp` together. Members
+    too large to be read in one go are streamed from the file object returned by `opener(member)`. """
+    for member, payload in _iter_member_payloads(fp, sorted(members, key=lambda m: m.header_offset),
+                                                 read_large=False):
+        if payload is None:
+            _extract_member_to(member, targetpath, opener, converter=converter)
+        else:
+            _extract_member_to(member, targetpath, data=_decode_payload(member, payload, key), converter=converter)
+        if on_extracted is not None:
+            on_extracted([member])
+
+
+class _PositionalFile:
+    """ File-like view of the P4K with its own position, used instead of :class:`zipfile._SharedFile`. Data is read
+    with the positional `pread(n, offset)` callable, so readers share no file position and take no lock.
+
+    :param pread: Callable returning up to `n` bytes from `offset` of the P4K
+    :param pos: Initial position
+    :param close: Called with this object when it is closed
+    """
+
+    def __init__(self, pread, pos, close=None):
+        self._pread = pread
+        self._pos = pos
+        self._close = close
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            raise io.UnsupportedOperation("can't seek from the end of a P4K member")
+        self._pos = offset
+        return self._pos
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            raise io.UnsupportedOperation("reads from a P4K member must have a size")
+        chunks = []
+        while n > 0 and (chunk := self._pread(n, self._pos)):
+            # reads larger than 2GiB may be split by the OS
+            chunks.append(chunk)
+            self._pos += len(chunk)
+            n -= len(chunk)
+        return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+    def close(self):
+        if self._pread is not None:
+            self._pread = None
+            if self._close is not None:
+                self._close(self)
+
+
+class _P4KExtractWorker:
+    """ Extracts batches of :class:`P4KInfo` from a P4K file. Every worker thread/process reads through its own file
+    handle, so batches can be extracted concurrently without sharing the :class:`P4KFile` file pointer. The handles of
+    worker threads are closed by :meth:`close`, worker processes close theirs after each batch.
+
+    Worker threads pass CryXmlB files to the shared `converter`. Worker processes can't, so if `convert_cryxml` is set
+    they convert inline and return the conversion stats of each batch, see :meth:`CryXMLConverter.merge`, along with
+    the names of the members that were converted. """
+
+    def __init__(self, filename, key, targetpath, convert_cryxml=False, converter=None):
+        self.filename = filename
+        self.key = key
+        self.targetpath = targetpath
+        self.convert_cryxml = convert_cryxml
+        self.converter = converter
+        self._in_process = False
+        self._init_fps()
+
+    def _init_fps(self):
+        self._local = threading.local()
+        self._fps = []
+        self._fps_lock = threading.Lock()
+
+    def __getstate__(self):
+        # the file handles of worker threads are not shared with worker processes
+        state = self.__dict__.copy()
+        for attr in ("_local", "_fps", "_fps_lock"):
+            del state[attr]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_fps()
+        self._in_process = True
+
+    def _fp(self):
+        """ Returns the calling thread's private file handle for the P4K """
+        fp = getattr(self._local, "fp", None)
+        if fp is None:
+            fp = self._local.fp = open(self.filename, "rb")
+            with self._fps_lock:
+                self._fps.append(fp)
+        return fp
+
+    def close(self):
+        """ Close the file handles opened by the worker threads """
+        with self._fps_lock:
+            fps, self._fps = self._fps, []
+        self._local = threading.local()
+        for fp in fps:
+            fp.close()
+
+    def _open(self, member):
+        fp = self._fp()
+        at_data = member._data_offset is not None
+        fp.seek(member._data_offset if at_data else member.header_offset)
+        return _open_member(fp, member, self.key, at_data=at_data)
+
+    def __call__(self, members):
+        converter = self.converter
+        converted = None
+        if converter is None and self.convert_cryxml:
+            converted = []
+            converter = CryXMLConverter(workers=None, on_converted=lambda m: converted.append(m.filename))
+        try:
+            _extract_members_sequentially(self._fp(), members, self.key, self.targetpath, self._open,
+                                          converter=converter)
+        finally:
+            if self._in_process:
+                # every batch given to a worker process is a new copy of the worker
+                self.close()
+        if converted is not None:
+            return converter.stats(), converted
+
+
+class _ByteBudget:
+    """ Limits the number of bytes in flight, blocking :meth:`acquire` until enough bytes are released. A single
+    request larger than the limit is allowed through once nothing else is in flight. """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        with self._cond:
+            while self.used and self.used + size > self.limit:
+                self._cond.wait()
+            self.used += size
+
+    def release(self, size):
+        with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+
+class _P4KExtractPipeline:
+    """ Extracts members from a P4K with separate read, decode and write stages connected by bounded queues.
+
+    The calling thread reads the raw data of the members in the order they are stored, merging adjacent members
+    into larger reads (see :func:`_iter_member_payloads`), `workers` threads decrypt and decompress
+    (both release the GIL) and `writers` threads write the results to disk. At most `max_bytes_in_flight`
+    compressed plus decompressed bytes are held between the stages, providing back pressure to the reader.
+    """
+
+    _DONE = object()
+
+    def __init__(self, filename, key, targetpath, converter=None, workers=4, writers=2,
+                 max_bytes_in_flight=256 * 1024 * 1024, on_extracted=None):
+        self.filename = filename
+        self.key = key
+        self.targetpath = targetpath
+        self.converter = converter
+        self.workers = max(1, workers)
+        self.writers = max(1, writers)
+        self.on_extracted = on_extracted
+
+        self._budget = _ByteBudget(max_bytes_in_flight)
+        self._decode_queue = queue.Queue(maxsize=self.workers * 2)
+        self._write_queue = queue.Queue(maxsize=self.writers * 2)
+        self._lock = threading.Lock()
+        self._error = None
+
+    def _fail(self, e):
+        with self._lock:
+            if self._error is None:
+                self._error = e
+
+    def _decode(self):
+        while (item := self._decode_queue.get()) is not self._DONE:
+            member, payload, size = item
+            if self._error is None:
+                try:
+                    self._write_queue.put((member, _decode_payload(member, payload, self.key), size))
+                    continue
+                except Exception as e:
+                    self._fail(e)
+            self._budget.release(size)
+
+    def _write(self):
+        while (item := self._write_queue.get()) is not self._DONE:
+            member, data, size = item
+            try:
+                if self._error is None:
+                    _extract_member_to(member, self.targetpath, data=data, converter=self.converter)
+                    if self.on_extracted is not None:
+                        with self._lock:
+                            self.on_extracted([member])
+            except Exception as e:
+                self._fail(e)
+            finally:
+                del data
+                self._budget.release(size)
+
+    def run(self, members):
+        decoders = [threading.Thread(target=self._decode, daemon=True) for _ in range(self.workers)]
+        writers = [threading.Thread(target=self._write, daemon=True) for _ in range(self.writers)]
+        for t in decoders + writers:
+            t.start()
+
+        try:
+            with open(self.filename, "rb") as fp:
+                for member, payload in _iter_member_payloads(fp, sorted(members, key=lambda m: m.header_offset)):
+                    if self._error is not None:
+                        break
+                    size = member.compress_size + member.file_size
+                    self._budget.acquire(size)
+                    self._decode_queue.put((member, payload, size))
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            for _ in decoders:
+                self._decode_queue.put(self._DONE)
+            for t in decoders:
+                t.join()
+            for _ in writers:
+                self._write_queue.put(self._DONE)
+            for t in writers:
+                t.join()
+
+        if self._error is not None:
+            raise self._error
+
+
+class _P4KInfoList(collections.abc.Sequence):
+    """ Read-only list of the :class:`P4KInfo` in a :class:`P4KFile`, each created on demand """
+
+    def __init__(self, p4k):
+        self._p4k = p4k
+
+    def __len__(self):
+        return len(self._p4k._index)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._p4k._info(_) for _ in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("P4K entry index out of range")
+        return self._p4k._info(i)
+
+
+class _P4KNameToInfo(collections.abc.Mapping):
+    """ Read-only mapping of file names to :class:`P4KInfo` in a :class:`P4KFile`, each created on demand """
+
+    def __init__(self, p4k):
+        self._p4k = p4k
+
+    def __getitem__(self, name):
+        return self._p4k._info(self._p4k._index.index_of(name))
+
+    def __contains__(self, name):
+        try:
+            self._p4k._index.index_of(name)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self._p4k._index.names)
+
+    def __len__(self):
+        return len(self._p4k._index)
+
+
+class P4KFile(zipfile.ZipFile):
+    def __init__(self, file, mode="r", key=DEFAULT_P4K_KEY, index_cache=None, content_cache=None,
+                 verify_headers=False):
+        """
+        :param file: Path to, or file object of, the P4K file
+        :param mode: Mode to open the P4K in
+        :param key: AES key used to decrypt encrypted entries
+        :param index_cache: Path to a sidecar file used to cache the parsed central directory between opens, or
+            `True` to use a cache file in the user's cache directory. The cache is only used while the size,
+            modification time and central directory location of the P4K are unchanged.
+        :param content_cache: Cache the decompressed contents of entries read with :meth:`read`,
+            :meth:`read_bytes` and :meth:`read_into`. Either a :class:`ContentCache`, which may be shared between
+            P4KFiles, the memory budget in bytes of a new one, or `True` for a new one with the default budget.
+        :param verify_headers: Read and validate the local file header of every entry that is opened or read. By
+            default the header is only read the first time an entry is read, after which the offset of its data is
+            taken from the index, see :meth:`resolve_data_offsets`.
+        """
+        if index_cache is True:
+            index_cache = default_index_cache_path(file) if isinstance(file, (str, os.PathLike)) else None
+        self._index_cache = index_cache or None
+        self._index_cache_key = None
+        self.verify_headers = verify_headers
+        self._mmap = None
+        self._pread = None
+        self._thread_local = threading.local()
+        self._thread_fps = []
+        # ZstdSeekPoints of the entries found to have more than one zstd frame
+        self._seek_points = {}
+
+        if isinstance(content_cache, bool):
+            content_cache = ContentCache() if content_cache else None
+        elif isinstance(content_cache, int):
+            content_cache = ContentCache(content_cache)
+        elif content_cache is not None and not isinstance(content_cache, ContentCache):
+            raise TypeError(f"content_cache: expected a ContentCache, int or bool, got {type(content_cache).__name__}")
+        self.content_cache = content_cache
+
+        # Using ZIP_STORED to bypass the get_compressor/get_decompressor logic in zipfile. Our P4KExtFile will always
+        # use zstd
+        super().__init__(file, mode, compression=zipfile.ZIP_STORED)
+        self.key = key
+
+    def _RealGetContents(self):
+        """Read in the table of contents for the ZIP file."""
+        fp = self.fp
+        try:
+            endrec = zipfile._EndRecData(fp)
+        except OSError:
+            raise zipfile.BadZipFile("File is not a zip file")
+        if not endrec:
+            raise zipfile.BadZipFile("File is not a zip file")
+        if self.debug > 1:
+            print(endrec)
+        size_cd = endrec[zipfile._ECD_SIZE]  # bytes in central directory
+        offset_cd = endrec[zipfile._ECD_OFFSET]  # offset of central directory
+        self._comment = endrec[zipfile._ECD_COMMENT]  # archive comment
+
+        # "concat" is zero, unless zip was concatenated to another file
+        concat = endrec[zipfile._ECD_LOCATION] - size_cd - offset_cd
+        if endrec[zipfile._ECD_SIGNATURE] == zipfile.stringEndArchive64:
+            # If Zip64 extension structures are present, account for them
+            concat -= zipfile.sizeEndCentDir64 + zipfile.sizeEndCentDir64Locator
+
+        if self.debug > 2:
+            inferred = concat + offset_cd
+            print("given, inferred, offset", offset_cd, inferred, concat)
+        # self.start_dir:  Position of start of central directory
+        self.start_dir = offset_cd + concat
+
+        index = cache_key = None
+        if self._index_cache is not None:
+            cache_key = index_cache_key(fp, self.start_dir, size_cd)
+            if cache_key is not None:
+                index = P4KIndex.load(self._index_cache, cache_key)
+
+        if index is None:
+            fp.seek(self.start_dir, 0)
+            data = fp.read(size_cd)
+            if len(data) != size_cd:
+                raise zipfile.BadZipFile("Truncated central directory")
+            index = P4KIndex.from_central_directory(data, concat)
+            if cache_key is not None:
+                index.save(self._index_cache, cache_key)
+
+        self._index_cache_key = cache_key
+        self._index = index
+        self.filelist = _P4KInfoList(self)
+        self.NameToInfo = _P4KNameToInfo(self)
+
+    def _info(self, i) -> "P4KInfo":
+        """ Create the :class:`P4KInfo` for the entry at index `i` """
+        return P4KInfo._from_index_entry(self._index.orig_name(i), self._index.entries[i].item())
+
+    def namelist(self):
+        """Return a list of file names in the archive."""
+        return list(self._index.names)
+
+    @property
+    def total_size(self) -> int:
+        """ Total uncompressed size of all the files in the archive """
+        return self._index.total_file_size
+
+    @property
+    def total_compress_size(self) -> int:
+        """ Total compressed size of all the files in the archive """
+        return self._index.total_compress_size
+
+    def _get_mmap(self):
+        """ Returns a read-only memory map of the P4K, or `None` if the P4K was not opened from a real file """
+        if self._mmap is None:
+            if not self.fp:
+                raise ValueError("Attempt to use ZIP archive that was already closed")
+            with self._lock:
+                if self._mmap is None:
+                    try:
+                        self._mmap = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+                    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+                        self._mmap = False
+        return self._mmap or None
+
+    def _remember_data_offset(self, zinfo):
+        """ Record the data offset resolved for `zinfo` in the index, so later reads of the entry skip its header """
+        i = self._index._name_lookup.get(zinfo.filename)
+        if i is not None and self._index.entries["header_offset"][i] == zinfo.header_offset:
+            self._index.entries["data_offset"][i] = zinfo._data_offset
+
+    def _data_offset(self, zinfo, buf) -> int:
+        """ Returns the offset of the data of `zinfo` within `buf`, a buffer of the entire P4K """
+        known = zinfo._data_offset is not None
+        offset = _local_data_offset(buf, zinfo, verify=self.verify_headers)
+        if not known:
+            self._remember_data_offset(zinfo)
+        return offset
+
+    def resolve_data_offsets(self, save=True) -> int:
+        """ Resolve the data offset of every entry in one pass over their local file headers, so no entry needs its
+        header read when it is opened or read. Only the header signatures are checked, use `verify_headers` to
+        validate each header as its entry is read. Returns the number of entries that were resolved.
+
+        :param save: Store the offsets in the index cache, if one is used, so they are resolved only once per P4K
+        """
+        buf = self._get_mmap()
+        if buf is not None:
+            resolved = self._index.resolve_data_offsets(buf)
+        else:
+            resolved = 0
+            with self._lock:
+                for i in np.flatnonzero(self._index.entries["data_offset"] == 0).tolist():
+                    zinfo = self._info(i)
+                    self.fp.seek(zinfo.header_offset)
+                    self._index.entries["data_offset"][i] = _read_local_header(self.fp, zinfo)
+                    resolved += 1
+        if resolved and save and self._index_cache is not None and self._index_cache_key is not None:
+            self._index.save(self._index_cache, self._index_cache_key)
+        return resolved
+
+    def _read_payload(self, zinfo, buf):
+        """ Returns the decrypted, but still compressed, data of `zinfo` from `buf`, a buffer of the entire P4K.
+        Unencrypted data is returned as a view into `buf`, which must be released by the caller. """
+        offset = self._data_offset(zinfo, buf)
+        payload = memoryview(buf)[offset:offset + zinfo.compress_size]
+        if self.key and zinfo.is_encrypted:
+            try:
+                return _P4KDecrypter(self.key)(payload)
+            finally:
+                payload.release()
+        return payload
+
+    def read_bytes(self, name) -> bytes:
+        """ Return the contents of `name`. Unlike :meth:`read` the compressed data is sliced directly from a memory
+        map of the P4K and decrypted/decompressed in a single call, which is considerably faster for small files.
+
+        :param name: File name within the P4K, or a :class:`P4KInfo`
+        """
+        zinfo = name if isinstance(name, P4KInfo) else self.getinfo(name)
+        if self.content_cache is not None:
+            return self.content_cache.get_or_load(zinfo, self._read_bytes)
+        return self._read_bytes(zinfo)
+
+    def _read_bytes(self, zinfo) -> bytes:
+        buf = self._get_mmap()
+        if buf is None:
+            return super().read(zinfo)
+
+        offset = self._data_offset(zinfo, buf)
+        with memoryview(buf)[offset:offset + zinfo.compress_size] as payload:
+            return _decode_payload(zinfo, payload, self.key)
+
+    def read(self, name, pwd=None):
+        """Return file bytes for name."""
+        if self.content_cache is None:
+            return super().read(name, pwd)
+        zinfo = name if isinstance(name, P4KInfo) else self.getinfo(name)
+        return self.content_cache.get_or_load(zinfo, lambda z: super(P4KFile, self).read(z, pwd))
+
+    def read_into(self, name, buffer) -> int:
+        """ Read the contents of `name` into the preallocated, writable `buffer`, which must be at least
+        `file_size` bytes. Like :meth:`read_bytes` the data is read from a memory map of the P4K and decompressed
+        directly into `buffer`. Returns the number of bytes written.
+
+        :param name: File name within the P4K, or a :class:`P4KInfo`
+        :param buffer: Writable object supporting the buffer protocol
+        """
+        zinfo = name if isinstance(name, P4KInfo) else self.getinfo(name)
+        with memoryview(buffer) as view, view.cast("B") as out:
+            if len(out) < zinfo.file_size:
+                raise ValueError(f"Buffer is too small for {zinfo.filename} ({len(out)} < {zinfo.file_size})")
+            out = out[:zinfo.file_size]  # noqa
+
+            if self.content_cache is None:
+                return self._read_into(zinfo, out)
+
+            data = self.content_cache.get(zinfo)
+            if data is not None:
+                out[:] = data
+                return len(data)
+            pos = self._read_into(zinfo, out)
+            if self.content_cache.cacheable(zinfo):
+                self.content_cache.put(zinfo, bytes(out[:pos]))
+            return pos
+
+    def _read_into(self, zinfo, out) -> int:
+        buf = self._get_mmap()
+        if buf is None:
+            with self.open(zinfo) as source:
+                pos = 0
+                while pos < zinfo.file_size and (chunk := source.read(zinfo.file_size - pos)):
+                    out[pos:pos + len(chunk)] = chunk
+                    pos += len(chunk)
+                return pos
+
+        payload = self._read_payload(zinfo, buf)
+        try:
+            if zinfo.compress_type == zipfile.ZIP_STORED:
+                out[:] = payload[:zinfo.file_size]
+                return zinfo.file_size
+
+            pos = _zstd_decompress_into(payload, out)
+            return pos
+        finally:
+            if isinstance(payload, memoryview):
+                payload.release()
+
+    def iter_chunks(self, name, chunk_size=1024 * 1024):
+        """ Generator yielding the contents of `name` in chunks of at most `chunk_size` bytes. Like :meth:`read_bytes`
+        the data is read from a memory map of the P4K, so any number of generators can be used concurrently from
+        different threads without contending for the archive's file handle.
+
+        :param name: File name within the P4K, or a :class:`P4KInfo`
+        :param chunk_size: Maximum size of each chunk
+        """
+        zinfo = name if isinstance(name, P4KInfo) else self.getinfo(name)
+        buf = self._get_mmap()
+        if buf is None:
+            with self.open(zinfo) as source:
+                while chunk := source.read(chunk_size):
+                    yield chunk
+            return
+
+        offset = self._data_offset(zinfo, buf)
+        # the map is not exported between chunks, so the P4K can be closed before the generator is exhausted
+        source = _PayloadReader(buf, offset, offset + zinfo.compress_size,
+                                _P4KDecrypter(self.key) if self.key and zinfo.is_encrypted else None)
+        with contextlib.ExitStack() as stack:
+            if zinfo.compress_type != zipfile.ZIP_STORED:
+                source = stack.enter_context(
+                    zstd.ZstdDecompressor().stream_reader(source, read_across_frames=True)
+                )
+            left = zinfo.file_size
+            while left > 0:
+                try:
+                    chunk = source.read(min(chunk_size, left))
+                except zstd.ZstdError:
+                    # trailing data after the zstd frame, see `ZStdDecompressor`
+                    break
+                if not chunk:
+                    break
+                left -= len(chunk)
+                yield chunk[:len(chunk) + min(left, 0)]
+
+    def _thread_pread(self, n, offset) -> bytes:
+        """ Positional read through a file handle owned by the calling thread, for platforms without `os.pread` """
+        fp = getattr(self._thread_local, "fp", None)
+        if fp is None:
+            fp = self._thread_local.fp = open(self.filename, "rb")
+            with self._lock:
+                self._thread_fps.append(fp)
+        fp.seek(offset)
+        return fp.read(n)
+
+    def _get_pread(self):
+        """ Returns a `pread(n, offset)` callable that reads from the P4K without a shared file position, or `None`
+        if the P4K was opened from a file object that is not a real file """
+        if self._pread is None:
+            try:
+                self._pread = functools.partial(os.pread, self.fp.fileno())
+            except AttributeError:
+                # no os.pread (Windows), fall back to a file handle per thread
+                self._pread = self._thread_pread if self.filename and os.path.isfile(self.filename) else False
+            except (OSError, ValueError, io.UnsupportedOperation):
+                self._pread = False
+        return self._pread or None
+
+    def close(self):
+        """Close the file, and for mode 'w', 'x' and 'a' write the ending
+        records."""
+        try:
+            if self._mmap:
+                self._mmap.close()
+        finally:
+            self._mmap = None
+            self._pread = None
+            super().close()
+
+    def _fpclose(self, fp):
+        super()._fpclose(fp)
+        if not self._fileRefCnt:
+            # the archive and every open member have been closed
+            for thread_fp in self._thread_fps:
+                thread_fp.close()
+            self._thread_fps = []
+
+    def open(self, name, mode="r", pwd=None, *, force_zip64=False):
+        """Return file-like object for 'name'.
+
+        name is a string for the file name within the ZIP file, or a ZipInfo
+        object.
+
+        mode should be 'r' to read a file already in the ZIP file, or 'w' to
+        write to a file newly added to the archive.
+
+        pwd is the password to decrypt files (only used for reading).
+
+        When writing, if the file size is not known in advance but may exceed
+        2 GiB, pass force_zip64 to use the ZIP64 format, which can handle large
+        files.  If the size is known in advance, it is best to pass a ZipInfo
+        instance for name, with zinfo.file_size set.
+        """
+        if mode not in {"r", "w"}:
+            raise ValueError('open() requires mode "r" or "w"')
+        if pwd and not isinstance(pwd, bytes):
+            raise TypeError("pwd: expected bytes, got %s" % type(pwd).__name__)
+        if pwd and (mode == "w"):
+            raise ValueError("pwd is only supported for reading files")
+        if not self.fp:
+            raise ValueError("Attempt to use ZIP archive that was already closed")
+
+        # Make sure we have an info object
+        if isinstance(name, P4KInfo):
+            # 'name' is already an info object
+            zinfo = name
+        elif mode == "w":
+            zinfo = P4KInfo(name)
+            zinfo.compress_type = self.compression
+            zinfo._compresslevel = self.compresslevel
+        else:
+            # Get info object for name
+            zinfo = self.getinfo(name)
+
+        if mode == "w":
+            return self._open_to_write(zinfo, force_zip64=force_zip64)
+
+        if self._writing:
+            raise ValueError(
+                "Can't read from the ZIP file while there "
+                "is an open writing handle on it. "
+                "Close the writing handle before trying to read."
+            )
+
+        # Open for reading, starting at the member's data if its offset is known so the header need not be read:
+        read_header = self.verify_headers or zinfo._data_offset is None
+        offset = zinfo.header_offset if read_header else zinfo._data_offset
+        self._fileRefCnt += 1
+        pread = self._get_pread() if self.mode == "r" else None
+        if pread is not None:
+            # positional reads need no lock, so members can be read by many threads in parallel
+            fp = self.fp
+            zef_file = _PositionalFile(pread, offset, lambda _: self._fpclose(fp))
+        else:
+            zef_file = zipfile._SharedFile(
+                self.fp,
+                offset,
+                self._fpclose,
+                self._lock,
+                lambda: self._writing,
+            )
+        try:
+            if read_header:
+                _read_local_header(zef_file, zinfo)
+                self._remember_data_offset(zinfo)
+            return _open_member(zef_file, zinfo, self.key, mode, close_fileobj=True,
+                                seek_points=self._get_seek_points(zinfo), at_data=True)
+        except:
+            zef_file.close()
+            raise
+
+    def _get_seek_points(self, zinfo) -> ZstdSeekPoints:
+        """ Returns the cached seek points of `zinfo`, or new ones which will be cached once more than one frame is
+        found """
+        seek_points = self._seek_points.get(zinfo.filename)
+        if seek_points is None:
+            seek_points = ZstdSeekPoints(on_add=lambda sp: self._seek_points.setdefault(zinfo.filename, sp))
+        return seek_points
+
+    def scan_seek_points(self, name) -> ZstdSeekPoints:
+        """ Find all the zstd frames of `name` by walking its frame headers, without decompressing it, so that
+        seeking within files opened with :meth:`open` only decompresses from the nearest frame. Without a scan, frames
+        are only found as the file is read. The result is cached for the lifetime of the P4KFile.
+
+        :param name: File name within the P4K, or a :class:`P4KInfo`
+        """
+        zinfo = name if isinstance(name, P4KInfo) else self.getinfo(name)
+        seek_points = self._get_seek_points(zinfo)
+        if zinfo.compress_type == zipfile.ZIP_STORED:
+            return seek_points
+
+        buf = self._get_mmap()
+        if buf is None:
+            with self._lock:
+                payload = _read_member_payload(self.fp, zinfo, verify=self.verify_headers)
+            self._remember_data_offset(zinfo)
+            if self.key and zinfo.is_encrypted:
+                payload = _P4KDecrypter(self.key)(payload)
+        else:
+            payload = self._read_payload(zinfo, buf)
+        try:
+            return scan_zstd_frames(payload, seek_points)
+        finally:
+            if isinstance(payload, memoryview):
+                payload.release()
+
+    def extract_filter(self, file_filter, path=None, ignore_case=False, convert_cryxml=False, **kwargs):
+        """ Extract the members matching `file_filter`, see :meth:`search`. Additional keyword arguments are passed to
+        :meth:`extractall` """
+        self.extractall(path=path, members=self.search(file_filter, ignore_case=ignore_case),
+                        convert_cryxml=convert_cryxml, **kwargs)
+
+    def extract(self, member, path=None, pwd=None, convert_cryxml=False):
+        """Extract a member from the archive to the current working directory,
+           using its full name. Its file information is extracted as accurately
+           as possible. `member' may be a filename or a ZipInfo object. You can
+           specify a different directory using `path'.
+        """
+        if path is None:
+            path = os.getcwd()
+        else:
+            path = os.fspath(path)
+
+        return self._extract_member(member, path, pwd,
+                                    converter=CryXMLConverter(workers=None) if convert_cryxml else None)
+
+    def extractall(self, path=None, members=None, pwd=None, convert_cryxml=False, workers=1, use_processes=False,
+                   batch_size=64, manifest=None, pipelined=False, writers=2, max_bytes_in_flight=256 * 1024 * 1024,
+                   dedupe=None, cryxml_workers=0):
+        """Extract all members from the archive to the current working
+           directory. `path' specifies a different directory to extract to.
+           `members' is optional and must be a subset of the list returned
+           by namelist().
+
+           Members are extracted in the order they are stored in the P4K, and neighbouring members are read with
+           a single read and OS read-ahead hints, so the archive is read sequentially instead of seeking per member.
+
+           `workers' is the number of threads (or processes if `use_processes') used to extract members in batches
+           of `batch_size'. Each worker reads through its own file handle. A value of 0 will use one worker per CPU.
+
+           `manifest' is an optional path to an :class:`ExtractManifest`. When given, members whose size, CRC and
+           date match a previous extraction into `path' are skipped, and members are recorded as they are
+           extracted so an interrupted extraction can be resumed. If `convert_cryxml' is set, `xml' members that were
+           not converted to JSON by a previous extraction are extracted again.
+
+           If `pipelined' is set, members are read sequentially by the calling thread, decrypted and decompressed by
+           `workers' threads and written by `writers' threads, with at most `max_bytes_in_flight' bytes buffered
+           between the stages. See :class:`_P4KExtractPipeline`.
+
+           `dedupe' is one of :data:`DEDUPE_MODES`. When given, members with the same CRC and sizes are only
+           decompressed once and their duplicates are created as `hardlink', `reflink' or `symlink' to it.
+
+           If `convert_cryxml' is set, CryXmlB files are also converted to JSON from their decompressed contents, in a
+           pool of `cryxml_workers' processes (0 for one per CPU) so conversion overlaps with extraction. When
+           extracting with worker processes each worker converts its own files instead. See
+           :class:`CryXMLConverter`.
+        """
+        if members is None:
+            members = self.namelist()
+
+        if path is None:
+            path = os.getcwd()
+        else:
+            path = os.fspath(path)
+
+        if workers == 0:
+            workers = os.cpu_count() or 1
+
+        members = [m if isinstance(m, P4KInfo) else self.getinfo(m) for m in members]
+        with contextlib.ExitStack() as stack:
+            if manifest is not None:
+                manifest = stack.enter_context(ExtractManifest(manifest))
+                total = len(members)
+                members = manifest.outdated(members, lambda m: _member_target_path(m, path),
+                                            convert_cryxml=convert_cryxml)
+                if len(members) != total:
+                    print(f"Skipping {total - len(members)} unchanged files")
+            record_extracted = manifest.add if manifest is not None else (lambda _: None)
+
+            converter = None
+            in_worker_processes = use_processes and workers > 1 and not pipelined
+            if convert_cryxml:
+                # worker processes convert their own files, the converter only totals their stats
+                converter = stack.enter_context(
+                    CryXMLConverter(workers=None if in_worker_processes else cryxml_workers,
+                                    on_converted=manifest.converted if manifest is not None else None)
+                )
+
+            duplicates = []
+            if dedupe is not None:
+                if dedupe not in DEDUPE_MODES:
+                    raise ValueError(f"Unsupported dedupe mode {dedupe}, expected one of {DEDUPE_MODES}")
+                members, duplicates = group_duplicates(members, convert_cryxml=convert_cryxml)
+
+            # extract in the order the members are stored so the P4K is read sequentially
+            members.sort(key=lambda m: m.header_offset)
+            start_time = time.perf_counter()
+
+            if pipelined:
+                if not self.filename:
+                    raise ValueError("Pipelined extraction requires a P4KFile opened from a file name")
+                _P4KExtractPipeline(self.filename, self.key, path, converter=converter, workers=workers,
+                                    writers=writers, max_bytes_in_flight=max_bytes_in_flight,
+                                    on_extracted=record_extracted).run(members)
+            elif workers <= 1:
+                if self.filename and os.path.isfile(self.filename):
+                    with open(self.filename, "rb") as fp:
+                        _extract_members_sequentially(fp, members, self.key, path, self.open,
+                                                      converter=converter, on_extracted=record_extracted)
+                else:
+                    for zipinfo in members:
+                        self._extract_member(zipinfo, path, pwd, converter=converter)
+                        record_extracted([zipinfo])
+            else:
+                if not self.filename:
+                    raise ValueError("Extracting with multiple workers requires a P4KFile opened from a file name")
+
+                extract_worker = _P4KExtractWorker(self.filename, self.key, path, convert_cryxml=convert_cryxml,
+                                                   converter=None if use_processes else converter)
+                executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+                with contextlib.closing(extract_worker), executor_class(max_workers=workers) as executor:
+                    futures = {
+                        executor.submit(extract_worker, members[i:i + batch_size]): members[i:i + batch_size]
+                        for i in range(0, len(members), batch_size)
+                    }
+                    try:
+                        for future in as_completed(futures):
+                            result = future.result()
+                            record_extracted(futures[future])
+                            if result is not None:
+                                stats, converted = result
+                                converter.merge(stats)
+                                if manifest is not None:
+                                    converted = set(converted)
+                                    for member in futures[future]:
+                                        if member.filename in converted:
+                                            manifest.converted(member)
+                    except BaseException:
+                        for future in futures:
+                            future.cancel()
+                        raise
+
+            elapsed = time.perf_counter() - start_time
+            if members and elapsed > 0:
+                read_mb = sum(m.compress_size for m in members) / (1024 * 1024)
+                written_mb = sum(m.file_size for m in members) / (1024 * 1024)
+                print(f"Extracted {len(members)} files in {elapsed:.2f}s: {read_mb / elapsed:.1f} MB/s read, "
+                      f"{written_mb / elapsed:.1f} MB/s written")
+
+            if converter is not None:
+                converter.close()
+                converter.report()
+
+            if duplicates:
+                _link_duplicates(duplicates, path, dedupe, convert_cryxml=convert_cryxml,
+                                 on_linked=manifest.add_duplicate if manifest is not None else None)
+
+    def write_archive(self, fileobj, members=None, archive_format="tar"):
+        """ Stream members into a `tar` or `zip` (using standard zstd compression) archive written to `fileobj`,
+        without extracting them to disk. `fileobj` may be a path or a binary file object, which does not need to be
+        seekable (e.g. `sys.stdout.buffer`). Members are written in the order they are stored in the P4K.
+        `members` is optional and must be a subset of the list returned by namelist().
+        """
+        if members is None:
+            members = self.filelist
+        members = [m if isinstance(m, P4KInfo) else self.getinfo(m) for m in members]
+
+        if isinstance(fileobj, (str, os.PathLike)):
+            with open(fileobj, "wb") as f:
+                write_archive(self, f, members, archive_format)
+        else:
+            write_archive(self, fileobj, members, archive_format)
+
+    def search(self, file_filter, ignore_case=True):
+        """ Search the filelist by path """
+        file_filter = "/".join(
+            file_filter.split("\\")
+        )  # normalize path slashes from windows to posix
+        r = re.compile(fnmatch.translate(file_filter), flags=re.IGNORECASE if ignore_case else 0)
+        return self._index.match(r, prefix=literal_prefix(file_filter))
+
+    def glob(self, pattern, ignore_case=True):
+        """ Returns the names of the files matching the posix style glob `pattern`. `*` only matches within a single
+        directory, use `**` to match any number of directories. """
+        pattern = "/".join(pattern.split("\\"))
+        return self._index.match(glob_to_regex(pattern, ignore_case), prefix=literal_prefix(pattern))
+
+    def query(self, file_filter=None, ignore_case=True, compress_type=None, **conditions) -> list:
+        """ Returns the names of the files matching `file_filter` (see :meth:`search`) and every one of the
+        `conditions` on their metadata, e.g. all encrypted files over 100MB:
+
+        >>> p4k.query("Data/*", encrypted=True, min_size=100 * 1024 * 1024)
+
+        The conditions are evaluated over the whole index at once, without creating a :class:`P4KInfo` per file. See
+        :meth:`P4KIndex.query <scdatatools.p4k.index.P4KIndex.query>` for the available conditions.
+
+        :param file_filter: Optional posix style file filter of the file names
+        :param ignore_case: Ignore case when matching `file_filter`
+        :param compress_type: Compression method (or list of them), as a number or one of :data:`COMPRESS_TYPES`
+        """
+        indices = None
+        if file_filter is not None and file_filter != "*":
+            file_filter = "/".join(file_filter.split("\\"))
+            r = re.compile(fnmatch.translate(file_filter), flags=re.IGNORECASE if ignore_case else 0)
+            indices = self._index.match_indices(r, prefix=literal_prefix(file_filter))
+        if compress_type is not None:
+            compress_type = [COMPRESS_TYPES.get(t, t) for t in
+                             ([compress_type] if isinstance(compress_type, (str, int)) else compress_type)]
+        names = self._index.names
+        return [names[i] for i in self._index.query(indices, compress_type=compress_type, **conditions).tolist()]
+
+    def listdir(self, path=""):
+        """ Returns the names of the directories and files directly within the directory `path`. Directories in a
+        P4K are implicit and paths are matched ignoring case. """
+        dirs, files = self._index.scandir(path.replace("\\", "/"))
+        return dirs + files
+
+    def walk(self, top=""):
+        """ Directory tree generator like :func:`os.walk`, yielding `(dirpath, dirnames, filenames)` for each
+        directory beneath `top`, top-down. `dirnames` may be modified in place to prune the walk. """
+        stack = [top.replace("\\", "/").strip("/")]
+        while stack:
+            dirpath = stack.pop()
+            dirnames, filenames = self._index.scandir(dirpath)
+            yield dirpath, dirnames, filenames
+            stack.extend(f"{dirpath}/{d}" if dirpath else d for d in reversed(dirnames))
+
+    def exists(self, path):
+        """ Returns `True` if `path` is a file or a directory within the P4K, ignoring case """
+        return self._index.exists(path.replace("\\", "/"))
+
+    def _extract_member(self, member, targetpath, pwd, converter=None):
+        """Extract the ZipInfo object 'member' to a physical
+           file on the path targetpath.
+        """
+        if not isinstance(member, P4KInfo):
+            member = self.getinfo(member)
+        return _extract_member_to(member, targetpath, self.open, converter=converter)
+
+
+if __name__ == "__main__":
+    PTU_DIR = "D:/Games/RSI/StarCitizen/PTU/"
+    p4k = P4KFile(os.path.join(PTU_DIR, "Data.p4k"))
+    # print(p4k.filelist)
+    # p4k.extractall(PTU_DIR)
+    p4k.extract_filter("*.xml", PTU_DIR)
+    # p4k.extract('Data/Scripts/Loadouts/Vehicles/Default_Loadout_AEGS_Retaliator.xml', PTU_DIR)
+    # p4k.extract('Data/Objects/buildingsets/hangar/asteroid/textures/uee_asteroid_hangar_plasticsheet_01_diff.dds.6', PTU_DIR)
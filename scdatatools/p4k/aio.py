@@ -0,0 +1,92 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from scdatatools.p4k import P4KFile, DEFAULT_P4K_KEY
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class AsyncP4KFile:
+    """ asyncio interface to a :class:`P4KFile` for serving files from many concurrent tasks.
+
+    Reads, decryption and decompression run in a thread pool so they never block the event loop. Data is read from a
+    memory map of the P4K instead of through the archive's shared file handle, so concurrent reads do not serialize
+    on its lock, and zstd decompression releases the GIL, letting throughput scale with the number of workers.
+
+    >>> async with AsyncP4KFile("Data.p4k") as p4k:
+    ...     data = await p4k.read("Data/Game.dcb")
+    ...     async for chunk in p4k.iter_chunks("Data/Objects/ships/aegs/gladius.cga"):
+    ...         ...
+
+    Opening parses the central directory synchronously, use :meth:`open` to do this off the event loop.
+
+    :param file: Path to, or file object of, the P4K file, or an open :class:`P4KFile`
+    :param key: AES key used to decrypt encrypted entries
+    :param index_cache: Passed to :class:`P4KFile`, caches the parsed central directory between opens
+    :param max_workers: Number of threads used for reads, defaults to the number of CPUs
+    :param executor: Executor to run reads in instead of creating a thread pool
+    """
+
+    def __init__(self, file, key=DEFAULT_P4K_KEY, index_cache=None, max_workers=None, executor=None):
+        self.p4k = file if isinstance(file, P4KFile) else P4KFile(file, key=key, index_cache=index_cache)
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                                                        thread_name_prefix="AsyncP4KFile")
+
+    @classmethod
+    async def open(cls, file, **kwargs) -> "AsyncP4KFile":
+        """ Create an :class:`AsyncP4KFile` without blocking the event loop while the central directory is read """
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: cls(file, **kwargs))
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def getinfo(self, name):
+        return self.p4k.getinfo(name)
+
+    def namelist(self):
+        return self.p4k.namelist()
+
+    def search(self, file_filter, ignore_case=True):
+        return self.p4k.search(file_filter, ignore_case=ignore_case)
+
+    def exists(self, path):
+        return self.p4k.exists(path)
+
+    async def read(self, name) -> bytes:
+        """ Return the contents of `name`, see :meth:`P4KFile.read_bytes`
+
+        :param name: File name within the P4K, or a :class:`P4KInfo`
+        """
+        return await self._run(self.p4k.read_bytes, name)
+
+    async def read_into(self, name, buffer) -> int:
+        """ Read the contents of `name` into `buffer`, see :meth:`P4KFile.read_into` """
+        return await self._run(self.p4k.read_into, name, buffer)
+
+    async def iter_chunks(self, name, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Asynchronously iterate over the contents of `name` in chunks of at most `chunk_size` bytes, only
+        decompressing the next chunk as it is requested.
+
+        :param name: File name within the P4K, or a :class:`P4KInfo`
+        :param chunk_size: Maximum size of each chunk
+        """
+        chunks = self.p4k.iter_chunks(name, chunk_size)
+        try:
+            while (chunk := await self._run(next, chunks, None)) is not None:
+                yield chunk
+        finally:
+            await self._run(chunks.close)
+
+    async def close(self):
+        """ Close the P4K, waiting for in flight reads to finish """
+        if self._own_executor:
+            await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        self.p4k.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
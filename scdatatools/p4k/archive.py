@@ -0,0 +1,141 @@
+import time
+import struct
+import tarfile
+import zipfile
+
+import zstandard as zstd
+
+# Compression method for zstd as defined by the ZIP specification, P4K files use the non-standard 100
+ZIP_ZSTD_STANDARD = 93
+ARCHIVE_FORMATS = ["tar", "zip"]
+
+_CHUNK_SIZE = 1024 * 1024
+_ZIP64_LIMIT = 0xFFFFFFFF
+
+
+class _CountingWriter:
+    """ Wraps a (possibly unseekable) binary file object, keeping track of the number of bytes written """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.tell = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.tell += len(data)
+
+
+class StreamingZipWriter:
+    """ Writes a zip file to a file object that does not need to be seekable, such as `stdout`.
+
+    Every entry is written with a data descriptor, so its CRC and sizes do not need to be known before its data is
+    written, and with ZIP64 extensions so entries and archives may be larger than 4 GiB. Entries are compressed with
+    zstd using the standard zip compression method (93).
+
+    :param fileobj: Binary file object to write the zip to
+    :param level: zstd compression level
+    """
+
+    def __init__(self, fileobj, level=3):
+        self._out = _CountingWriter(fileobj)
+        self._cctx = zstd.ZstdCompressor(level=level)
+        self._entries = []
+
+    def write_stream(self, name, date_time, source, compress=True):
+        """ Add the file `name` reading its contents from the file object `source` until EOF.
+
+        :param name: Name of the file within the zip
+        :param date_time: Modification time of the file as `(year, month, day, hour, min, sec)`
+        :param source: Readable binary file object
+        :param compress: Compress the file using zstd, otherwise it is stored
+        """
+        name = name.encode("utf-8")
+        method = ZIP_ZSTD_STANDARD if compress else zipfile.ZIP_STORED
+        flags = 0x08 | 0x800  # data descriptor, utf-8 name
+        dos_time = date_time[3] << 11 | date_time[4] << 5 | date_time[5] // 2
+        dos_date = (date_time[0] - 1980) << 9 | date_time[1] << 5 | date_time[2]
+        header_offset = self._out.tell
+
+        # sizes are in the data descriptor, the empty zip64 extra marks them as 64-bit
+        extra = struct.pack("<HHQQ", 1, 16, 0, 0)
+        self._out.write(
+            struct.pack(zipfile.structFileHeader, zipfile.stringFileHeader, 63, 0, flags, method, dos_time, dos_date,
+                        0, _ZIP64_LIMIT, _ZIP64_LIMIT, len(name), len(extra))
+            + name + extra
+        )
+
+        crc = file_size = compress_size = 0
+        compressor = self._cctx.compressobj() if compress else None
+        while chunk := source.read(_CHUNK_SIZE):
+            crc = zipfile.crc32(chunk, crc)
+            file_size += len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            compress_size += len(chunk)
+            self._out.write(chunk)
+        if compressor is not None:
+            chunk = compressor.flush()
+            compress_size += len(chunk)
+            self._out.write(chunk)
+
+        self._out.write(struct.pack("<4sLQQ", b"PK\x07\x08", crc, compress_size, file_size))
+        self._entries.append((name, method, flags, dos_time, dos_date, crc, compress_size, file_size, header_offset))
+
+    def close(self):
+        """ Write the central directory. This does not close the underlying file object """
+        start_dir = self._out.tell
+        for name, method, flags, dos_time, dos_date, crc, compress_size, file_size, header_offset in self._entries:
+            zip64 = [v for v in (file_size, compress_size, header_offset) if v >= _ZIP64_LIMIT]
+            extra = struct.pack(f"<HH{len(zip64)}Q", 1, 8 * len(zip64), *zip64) if zip64 else b""
+            self._out.write(
+                struct.pack(zipfile.structCentralDir, zipfile.stringCentralDir, 63, 3, 63 if zip64 else 20, 0,
+                            flags, method, dos_time, dos_date, crc, min(compress_size, _ZIP64_LIMIT),
+                            min(file_size, _ZIP64_LIMIT), len(name), len(extra), 0, 0, 0, 0o100644 << 16,
+                            min(header_offset, _ZIP64_LIMIT))
+                + name + extra
+            )
+        end_dir = self._out.tell
+        size_dir = end_dir - start_dir
+        count = len(self._entries)
+
+        if count > 0xFFFF or size_dir >= _ZIP64_LIMIT or start_dir >= _ZIP64_LIMIT:
+            self._out.write(struct.pack(zipfile.structEndArchive64, zipfile.stringEndArchive64,
+                                        zipfile.sizeEndCentDir64 - 12, 45, 45, 0, 0, count, count, size_dir,
+                                        start_dir))
+            self._out.write(struct.pack(zipfile.structEndArchive64Locator, zipfile.stringEndArchive64Locator, 0,
+                                        end_dir, 1))
+        self._out.write(struct.pack(zipfile.structEndArchive, zipfile.stringEndArchive, 0, 0, min(count, 0xFFFF),
+                                    min(count, 0xFFFF), min(size_dir, _ZIP64_LIMIT), min(start_dir, _ZIP64_LIMIT), 0))
+        self._entries = []
+
+
+def write_archive(p4k, fileobj, members, archive_format="tar"):
+    """ Stream `members` of the P4KFile `p4k` into an archive written to `fileobj`. Members are read in the order
+    they are stored within the P4K and streamed in chunks, so memory use does not depend on the size of the members.
+
+    :param p4k: :class:`P4KFile` to read the members from
+    :param fileobj: Binary file object the archive is written to, it does not need to be seekable
+    :param members: List of :class:`P4KInfo` to add to the archive
+    :param archive_format: One of :data:`ARCHIVE_FORMATS`, `tar` or `zip` (with zstd compression)
+    """
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unsupported archive format {archive_format}, expected one of {ARCHIVE_FORMATS}")
+
+    members = sorted((m for m in members if not m.is_dir()), key=lambda m: m.header_offset)
+
+    if archive_format == "tar":
+        with tarfile.open(fileobj=fileobj, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+            for member in members:
+                info = tarfile.TarInfo(member.filename)
+                info.size = member.file_size
+                info.mtime = time.mktime(member.date_time + (0, 0, -1))
+                info.mode = 0o644
+                with p4k.open(member) as source:
+                    tar.addfile(info, source)
+    else:
+        writer = StreamingZipWriter(fileobj)
+        for member in members:
+            with p4k.open(member) as source:
+                writer.write_stream(member.filename, member.date_time, source,
+                                    compress=member.compress_type != zipfile.ZIP_STORED)
+        writer.close()
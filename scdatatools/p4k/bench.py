@@ -0,0 +1,69 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+READ_METHODS = ["pread", "shared", "mmap"]
+
+
+class ReadBenchmark:
+    """ Result of reading the same set of files with a number of threads, see :func:`benchmark_reads`
+
+    :ivar threads: Number of threads used
+    :ivar seconds: Wall time taken to read every file
+    :ivar file_count: Number of files read
+    :ivar total_bytes: Total uncompressed bytes read
+    """
+
+    def __init__(self, threads, seconds, file_count, total_bytes):
+        self.threads = threads
+        self.seconds = seconds
+        self.file_count = file_count
+        self.total_bytes = total_bytes
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.total_bytes / (1024 * 1024) / self.seconds if self.seconds else 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.file_count / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return (
+            f"<ReadBenchmark threads:{self.threads} files:{self.file_count} "
+            f"{self.mb_per_second:.1f}MB/s {self.files_per_second:.0f} files/s>"
+        )
+
+
+def benchmark_reads(p4k, names, thread_counts=(1, 2, 4, 8), method="pread", warmup=True) -> list:
+    """ Read every file in `names` from `p4k` once for each of `thread_counts`, returning a :class:`ReadBenchmark`
+    for each. Files are distributed across the threads, so the results show how reads scale with threads.
+
+    :param p4k: :class:`P4KFile` to read from
+    :param names: File names to read
+    :param thread_counts: Numbers of threads to benchmark
+    :param method: How the files are read, one of :data:`READ_METHODS`. `pread` reads through :meth:`P4KFile.open`
+        using lock-free positional reads, `shared` through :meth:`P4KFile.open` using the archive's shared file
+        handle and lock (the behaviour of :class:`zipfile.ZipFile`) and `mmap` uses :meth:`P4KFile.read_bytes`
+    :param warmup: Read every file once before timing, so all the methods start with a warm OS page cache
+    """
+    if method not in READ_METHODS:
+        raise ValueError(f"Unsupported read method {method}, expected one of {READ_METHODS}")
+
+    read = p4k.read_bytes if method == "mmap" else p4k.read
+    saved_pread = p4k._pread
+    if method == "shared":
+        p4k._pread = False
+    try:
+        if warmup:
+            for name in names:
+                read(name)
+
+        results = []
+        for threads in thread_counts:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                total_bytes = sum(len(data) for data in executor.map(read, names))
+            results.append(ReadBenchmark(threads, time.perf_counter() - start, len(names), total_bytes))
+        return results
+    finally:
+        p4k._pread = saved_pread
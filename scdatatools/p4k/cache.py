@@ -0,0 +1,170 @@
+import os
+import threading
+import collections
+from pathlib import Path
+
+DEFAULT_CONTENT_CACHE_SIZE = 256 * 1024 * 1024
+
+
+class LRUCache:
+    """ Thread-safe LRU cache of `bytes` values, limited by the total size of the cached values.
+
+    :param max_bytes: Memory budget of the cache, least recently used values are evicted once it is exceeded
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CONTENT_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._values = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key):
+        """ Returns the cached value for `key`, or `None` """
+        with self._lock:
+            value = self._values.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._values.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """ Cache `value` for `key`, values larger than the whole budget are not cached """
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._values.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._values[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._values.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.size = 0
+
+
+class DiskCache:
+    """ Directory of cached values, one file per key. Files are written atomically so the directory can be shared
+    by multiple processes. The directory is not size limited.
+
+    :param path: Directory to store the cached values in, it is created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return self.path / "-".join(str(k) for k in key)
+
+    def get(self, key):
+        """ Returns the cached value for `key`, or `None` """
+        try:
+            value = self._path(key).read_bytes()
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """ Cache `value` for `key` """
+        path = self._path(key)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            tmp.write_bytes(value)
+            os.replace(tmp, path)
+        except OSError:
+            # the cache is best effort
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+
+
+class ContentCache:
+    """ Cache of the decompressed contents of P4K entries, used by :class:`P4KFile` when given as its
+    `content_cache`.
+
+    Entries are keyed by their CRC, file size and compressed size, so identical entries share a cached copy and a
+    cache can be shared between multiple P4KFiles (e.g. different builds). Contents are kept in a memory
+    :class:`LRUCache` and, if `disk_path` is given, also in a :class:`DiskCache` which persists between runs.
+
+    :param max_bytes: Memory budget of the cache
+    :param max_entry_size: Larger entries are not cached, defaults to an eighth of `max_bytes`
+    :param disk_path: Directory of the optional on-disk cache
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CONTENT_CACHE_SIZE, max_entry_size=None, disk_path=None):
+        self.memory = LRUCache(max_bytes)
+        self.disk = DiskCache(disk_path) if disk_path is not None else None
+        self.max_entry_size = max_bytes // 8 if max_entry_size is None else max_entry_size
+
+    @property
+    def hits(self) -> int:
+        """ Number of reads served by either tier of the cache """
+        return self.memory.hits + (self.disk.hits if self.disk is not None else 0)
+
+    @property
+    def misses(self) -> int:
+        """ Number of reads that had to decompress the entry """
+        return self.memory.misses - (self.disk.hits if self.disk is not None else 0)
+
+    @staticmethod
+    def _key(zinfo):
+        return f"{zinfo.CRC:08x}", zinfo.file_size, zinfo.compress_size
+
+    def cacheable(self, zinfo) -> bool:
+        return 0 < zinfo.file_size <= self.max_entry_size
+
+    def get(self, zinfo):
+        """ Returns the cached contents of the :class:`P4KInfo` `zinfo`, or `None` """
+        if not self.cacheable(zinfo):
+            return None
+        key = self._key(zinfo)
+        data = self.memory.get(key)
+        if data is None and self.disk is not None:
+            data = self.disk.get(key)
+            if data is not None:
+                self.memory.put(key, data)
+        return data
+
+    def put(self, zinfo, data):
+        """ Cache `data`, the contents of the :class:`P4KInfo` `zinfo` """
+        if not self.cacheable(zinfo) or len(data) != zinfo.file_size:
+            return
+        key = self._key(zinfo)
+        self.memory.put(key, data)
+        if self.disk is not None:
+            self.disk.put(key, data)
+
+    def get_or_load(self, zinfo, loader) -> bytes:
+        """ Returns the cached contents of `zinfo`, or calls `loader(zinfo)` to read and cache them """
+        data = self.get(zinfo)
+        if data is None:
+            data = loader(zinfo)
+            self.put(zinfo, data)
+        return data
+
+    def clear(self):
+        """ Clear the memory cache, the disk cache is left untouched """
+        self.memory.clear()
+
+    def __repr__(self):
+        return (
+            f"<ContentCache hits:{self.hits} misses:{self.misses} entries:{len(self.memory)} "
+            f"size:{self.memory.size}/{self.memory.max_bytes}>"
+        )
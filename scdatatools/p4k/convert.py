@@ -0,0 +1,170 @@
+import os
+import time
+import zipfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from scdatatools.cryxml import json_from_cryxml_file
+from scdatatools.p4k.dedupe import unlink_existing
+
+CRYXMLB_SIGNATURE = b"CryXmlB"
+
+
+def is_cryxml_member(member, data) -> bool:
+    """ Returns `True` if `member`, with the decompressed contents `data`, is a CryXmlB file that can be converted """
+    return member.filename.lower().endswith("xml") and bytes(data[:len(CRYXMLB_SIGNATURE)]) == CRYXMLB_SIGNATURE
+
+
+def cryxml_to_json(data, convertpath) -> float:
+    """ Convert the CryXmlB file `data` to JSON, written to `convertpath`. Returns the time taken in seconds. """
+    start = time.perf_counter()
+    # the JSON of a previous deduplicated extraction may be linked to that of other files
+    unlink_existing(convertpath)
+    json_from_cryxml_file(data, convertpath, indent=4, sort_keys=True)
+    return time.perf_counter() - start
+
+
+class CryXMLConverter:
+    """ Converts CryXmlB files to JSON as they are extracted from a P4K, directly from their decompressed contents.
+
+    Conversions run in a pool of `workers` processes, so they overlap with the extraction, or inline in the calling
+    thread if `workers` is `None`. At most `max_pending` files are queued for conversion at a time, after which
+    :meth:`submit` blocks.
+
+    :param workers: Number of conversion processes, 0 for one per CPU, or `None` to convert inline
+    :param max_pending: Maximum number of files queued in the process pool
+    :param on_converted: Optional function called with each submitted member once it has been converted, or straight
+        away if it is not a CryXmlB file. It is not called for files that could not be converted.
+
+    :ivar converted: Number of files converted
+    :ivar converted_bytes: Total size of the converted CryXmlB files
+    :ivar failed: Dict of the names of files that could not be converted to the error
+    """
+
+    def __init__(self, workers=0, max_pending=None, on_converted=None):
+        self.on_converted = on_converted
+        self.converted = 0
+        self.converted_bytes = 0
+        self.failed = {}
+        self._seconds = 0.0
+        self._created = time.perf_counter()
+        self._start = None
+        self._end = None
+        self._lock = threading.Lock()
+
+        self._executor = None
+        if workers is not None:
+            workers = workers or os.cpu_count() or 1
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+            self._pending = threading.Semaphore(max_pending or workers * 4)
+            self._futures = set()
+
+    def submit(self, member, data, targetpath):
+        """ Convert `member` with the decompressed contents `data`, which was extracted to `targetpath`, if it is a
+        CryXmlB file. The JSON is written next to it with a `.json` extension. """
+        if not is_cryxml_member(member, data):
+            if self.on_converted is not None:
+                self.on_converted(member)
+            return
+        convertpath = targetpath[:-3] + "json"
+        with self._lock:
+            if self._start is None:
+                self._start = time.perf_counter()
+
+        if self._executor is None:
+            try:
+                self._record(member, len(data), convertpath, cryxml_to_json(data, convertpath))
+            except Exception as e:
+                self._record_failure(member, e)
+            return
+
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(cryxml_to_json, bytes(data), convertpath)
+        except BaseException:
+            self._pending.release()
+            raise
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(lambda f: self._done(f, member, len(data), convertpath))
+
+    def _done(self, future, member, size, convertpath):
+        with self._lock:
+            self._futures.discard(future)
+        self._pending.release()
+        if future.cancelled():
+            return
+        e = future.exception()
+        if e is not None:
+            self._record_failure(member, e)
+        else:
+            self._record(member, size, convertpath, future.result())
+
+    def _record(self, member, size, convertpath, seconds):
+        with self._lock:
+            self.converted += 1
+            self.converted_bytes += size
+            self._seconds += seconds
+        print(f"{zipfile.compressor_names.get(member.compress_type)} | Converted | {convertpath}")
+        if self.on_converted is not None:
+            self.on_converted(member)
+
+    def _record_failure(self, member, e):
+        with self._lock:
+            self.failed[member.filename] = f"{type(e).__name__}: {e}"
+        print(f"Failed to convert {member.filename}: {type(e).__name__}: {e}")
+
+    def merge(self, stats):
+        """ Add the `stats` of a converter in another process, as returned by :meth:`stats` """
+        converted, converted_bytes, seconds, failed = stats
+        with self._lock:
+            if self._start is None:
+                # the other process started converting at some point since this converter was created
+                self._start = self._created
+            self.converted += converted
+            self.converted_bytes += converted_bytes
+            self._seconds += seconds
+            self.failed.update(failed)
+
+    def stats(self) -> tuple:
+        """ Returns the conversion counts, for :meth:`merge` """
+        with self._lock:
+            return self.converted, self.converted_bytes, self._seconds, dict(self.failed)
+
+    def close(self):
+        """ Wait for the queued conversions to finish """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._start is not None:
+            self._end = time.perf_counter()
+
+    def cancel(self):
+        """ Cancel the queued conversions """
+        if self._executor is not None:
+            with self._lock:
+                futures = list(self._futures)
+            for future in futures:
+                future.cancel()
+            self.close()
+
+    def report(self):
+        """ Print a summary of the conversions """
+        if self._start is None:
+            return
+        elapsed = (self._end or time.perf_counter()) - self._start
+        mb = self.converted_bytes / (1024 * 1024)
+        print(f"Converted {self.converted} CryXML files ({mb:.1f} MB) to JSON in {elapsed:.2f}s: "
+              f"{self.converted / elapsed if elapsed else 0:.0f} files/s, {mb / elapsed if elapsed else 0:.1f} MB/s, "
+              f"{self._seconds:.2f}s spent converting")
+        if self.failed:
+            print(f"{len(self.failed)} CryXML files could not be converted")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.cancel()
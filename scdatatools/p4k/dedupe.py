@@ -0,0 +1,90 @@
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEDUPE_MODES = ["hardlink", "reflink", "symlink"]
+
+# ioctl to share the extents of one file with another on copy-on-write filesystems (btrfs, xfs)
+_FICLONE = 0x40049409
+
+
+def group_duplicates(members, convert_cryxml=False):
+    """ Split `members` into the unique members that have to be extracted, and the duplicates of them which can be
+    linked to an extracted copy instead. Members are duplicates if their CRC, file size and compressed size are the
+    same. Directories and empty files are never treated as duplicates.
+
+    Returns `(unique, duplicates)` where `duplicates` is a list of `(member, original)` pairs.
+
+    :param members: List of :class:`P4KInfo`
+    :param convert_cryxml: Whether CryXML files will be converted, in which case `xml` files are only duplicates of
+        other `xml` files so their converted JSON can be linked as well
+    """
+    unique = []
+    duplicates = []
+    originals = {}
+    for member in members:
+        if member.is_dir() or not member.file_size:
+            unique.append(member)
+            continue
+        key = (member.CRC, member.file_size, member.compress_size,
+               convert_cryxml and member.filename.lower().endswith("xml"))
+        original = originals.setdefault(key, member)
+        if original is member:
+            unique.append(member)
+        else:
+            duplicates.append((member, original))
+    return unique, duplicates
+
+
+def unlink_existing(path):
+    """ Remove the file or link at `path`, if there is one, so it is written as a new file. Opening an existing hardlink
+    or symlink for writing would change every path linked to it, e.g. the duplicates of a previous extraction with
+    `dedupe`. """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+
+
+def link_file(src, dst, mode="hardlink") -> bool:
+    """ Make `dst` a copy of the file `src` by creating a hardlink, reflink or (relative) symlink to it. Falls back to
+    copying `src` if the link could not be created, e.g. as the filesystem does not support it. Returns `True` if a
+    link was created.
+
+    :param src: Path of the existing file
+    :param dst: Path to create, any existing file is replaced
+    :param mode: One of :data:`DEDUPE_MODES`
+    """
+    if mode not in DEDUPE_MODES:
+        raise ValueError(f"Unsupported dedupe mode {mode}, expected one of {DEDUPE_MODES}")
+
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            # already linked, or a case-insensitive filesystem where both names are the same file
+            return True
+        os.unlink(dst)
+
+    try:
+        if mode == "hardlink":
+            os.link(src, dst)
+        elif mode == "symlink":
+            os.symlink(os.path.relpath(src, os.path.dirname(dst)), dst)
+        else:
+            _reflink(src, dst)
+        return True
+    except OSError:
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        shutil.copyfile(src, dst)
+        return False
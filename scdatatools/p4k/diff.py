@@ -0,0 +1,78 @@
+import numpy as np
+
+
+class P4KDiff:
+    """ The differences between two P4K files, as found by :func:`diff_p4k`.
+
+    :ivar added: Names of the files only in the new P4K
+    :ivar removed: Names of the files only in the old P4K
+    :ivar changed: Names of the files whose contents changed
+    :ivar ambiguous: Names of the files whose size and CRC are the same but whose date or compression changed. The
+        contents of these files may or may not have changed, use `verify` with :func:`diff_p4k` to resolve them.
+    :ivar unchanged: Number of files that are the same in both P4K files
+    """
+
+    def __init__(self, added=None, removed=None, changed=None, ambiguous=None, unchanged=0):
+        self.added = added or []
+        self.removed = removed or []
+        self.changed = changed or []
+        self.ambiguous = ambiguous or []
+        self.unchanged = unchanged
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed or self.ambiguous)
+
+    def __repr__(self):
+        return (
+            f"<P4KDiff added:{len(self.added)} removed:{len(self.removed)} changed:{len(self.changed)} "
+            f"ambiguous:{len(self.ambiguous)} unchanged:{self.unchanged}>"
+        )
+
+
+def diff_p4k(old, new, verify=False) -> P4KDiff:
+    """ Compare the central directories of two P4K files without decompressing any data.
+
+    Entries are matched by name, then their file size, CRC, compressed size, compression, encryption and date are
+    compared for every entry at once. Entries with a different size or CRC have changed. Entries where only the
+    date or compression differ are `ambiguous`, if `verify` is set these are decompressed from both P4K files and
+    compared to determine if they have changed.
+
+    :param old: The old :class:`P4KFile`
+    :param new: The new :class:`P4KFile`
+    :param verify: Compare the contents of ambiguous entries
+    """
+    old_index, new_index = old._index, new._index
+    old_pos = old_index.indices_of(new_index.names)
+    in_old = old_pos >= 0
+
+    removed_mask = np.ones(len(old_index), dtype=bool)
+    removed_mask[old_pos[in_old]] = False
+
+    new_pos = np.flatnonzero(in_old)
+    old_entries = old_index.entries[old_pos[in_old]]
+    new_entries = new_index.entries[new_pos]
+
+    def differs(*fields):
+        return np.logical_or.reduce([old_entries[f] != new_entries[f] for f in fields])
+
+    content_changed = differs("file_size", "CRC")
+    ambiguous = ~content_changed & differs("compress_size", "compress_type", "is_encrypted", "date", "time")
+
+    new_names = new_index.names
+    diff = P4KDiff(
+        added=[new_names[i] for i in np.flatnonzero(~in_old).tolist()],
+        removed=[old_index.names[i] for i in np.flatnonzero(removed_mask).tolist()],
+        changed=[new_names[i] for i in new_pos[content_changed].tolist()],
+        ambiguous=[new_names[i] for i in new_pos[ambiguous].tolist()],
+        unchanged=int(np.count_nonzero(~content_changed & ~ambiguous)),
+    )
+
+    if verify:
+        for name in diff.ambiguous:
+            if old.read_bytes(name) != new.read_bytes(name):
+                diff.changed.append(name)
+            else:
+                diff.unchanged += 1
+        diff.ambiguous = []
+
+    return diff
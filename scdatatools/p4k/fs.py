@@ -0,0 +1,203 @@
+from fsspec.spec import AbstractFileSystem, AbstractBufferedFile
+
+from scdatatools.p4k import P4KFile, DEFAULT_P4K_KEY
+from scdatatools.p4k.cache import LRUCache
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+
+class BlockCache(LRUCache):
+    """ LRU cache of decompressed blocks shared by the files of a :class:`P4KFileSystem`, limited by the total size
+    of the cached blocks.
+
+    :param max_bytes: Memory budget of the cache, least recently used blocks are evicted once it is exceeded
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_SIZE):
+        super().__init__(max_bytes)
+
+
+class _P4KBlockReader:
+    """ Reads ranges of a P4K entry through the block cache of a :class:`P4KFileSystem`. Blocks that are not cached
+    are read from a single handle to the entry, so sequential reads continue decompressing where the last block
+    ended. """
+
+    def __init__(self, fs, name):
+        self.fs = fs
+        self.name = name
+        try:
+            self.info = fs.p4k.getinfo(name)
+        except KeyError:
+            raise FileNotFoundError(name)
+        self._handle = None
+
+    def _block(self, i):
+        key = (self.name, i)
+        block = self.fs.block_cache.get(key)
+        if block is not None:
+            return block
+
+        block_size = self.fs.block_size
+        if self.info.file_size <= block_size:
+            block = self.fs.p4k.read_bytes(self.info)
+        else:
+            if self._handle is None:
+                self._handle = self.fs.p4k.open(self.info)
+            if self._handle.tell() != i * block_size:
+                self._handle.seek(i * block_size)
+            block = self._handle.read(block_size)
+        self.fs.block_cache.put(key, block)
+        return block
+
+    def read(self, start, end) -> bytes:
+        """ Returns the bytes `start` to `end` of the entry """
+        end = min(end, self.info.file_size)
+        if start >= end:
+            return b""
+        block_size = self.fs.block_size
+        parts = []
+        for i in range(start // block_size, (end - 1) // block_size + 1):
+            offset = i * block_size
+            block = self._block(i)
+            parts.append(block[max(start - offset, 0):end - offset])
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+class P4KBufferedFile(AbstractBufferedFile):
+    """ Read-only file within a :class:`P4KFileSystem`, reads are served from the filesystem's block cache """
+
+    def __init__(self, fs, path, **kwargs):
+        self._reader = _P4KBlockReader(fs, path)
+        # the block cache replaces fsspec's own read caching
+        kwargs["cache_type"] = "none"
+        super().__init__(fs, path, mode="rb", size=self._reader.info.file_size, **kwargs)
+
+    def _fetch_range(self, start, end):
+        return self._reader.read(start, end)
+
+    def close(self):
+        super().close()
+        self._reader.close()
+
+
+class P4KFileSystem(AbstractFileSystem):
+    """ Read-only `fsspec <https://filesystem-spec.readthedocs.io>`_ filesystem of the files within a P4K, using its
+    central directory for listings and reading files on demand without extracting them.
+
+    Decompressed data is held in a :class:`BlockCache` shared by every file opened from the filesystem. Directories
+    are implicit, as they are in the P4K.
+
+    >>> fs = P4KFileSystem("Data.p4k")
+    >>> fs.ls("Data/Libs")
+    >>> with fs.open("Data/Libs/Foundry/Records/entities/spaceships/aegs_gladius.xml") as f:
+    ...     f.read()
+
+    The filesystem is also registered with fsspec as the `p4k` protocol, e.g.
+    `fsspec.open("p4k://Data/Game.dcb", fo="Data.p4k")`
+
+    :param fo: Path to the P4K, a file object of it, or an open :class:`P4KFile`
+    :param key: AES key used to decrypt encrypted entries
+    :param index_cache: Passed to :class:`P4KFile`, caches the parsed central directory between opens
+    :param block_size: Size of the decompressed blocks files are read and cached in
+    :param cache_size: Memory budget of the block cache in bytes
+    """
+
+    protocol = "p4k"
+    root_marker = ""
+
+    def __init__(self, fo="", key=DEFAULT_P4K_KEY, index_cache=True, block_size=DEFAULT_BLOCK_SIZE,
+                 cache_size=DEFAULT_CACHE_SIZE, **kwargs):
+        super().__init__(**kwargs)
+        self.p4k = fo if isinstance(fo, P4KFile) else P4KFile(fo, key=key, index_cache=index_cache)
+        self.block_size = block_size
+        self.block_cache = BlockCache(cache_size)
+
+    @classmethod
+    def _strip_protocol(cls, path):
+        path = super()._strip_protocol(path)
+        return path.replace("\\", "/").strip("/")
+
+    def _file_info(self, name, i):
+        entry = self.p4k._index.entries[i]
+        return {
+            "name": name,
+            "size": int(entry["file_size"]),
+            "type": "file",
+            "compress_size": int(entry["compress_size"]),
+            "CRC": int(entry["CRC"]),
+            "is_encrypted": bool(entry["is_encrypted"]),
+        }
+
+    @staticmethod
+    def _dir_info(name):
+        return {"name": name, "size": 0, "type": "directory"}
+
+    def info(self, path, **kwargs):
+        path = self._strip_protocol(path)
+        try:
+            return self._file_info(path, self.p4k._index.index_of(path))
+        except KeyError:
+            if self.p4k._index.exists(path):
+                return self._dir_info(path)
+        raise FileNotFoundError(path)
+
+    def ls(self, path, detail=True, **kwargs):
+        path = self._strip_protocol(path)
+        try:
+            dirnames, files = self.p4k._index.scandir_indices(path)
+        except FileNotFoundError:
+            # a file, fsspec lists a file as itself
+            info = self.info(path)
+            return [info] if detail else [info["name"]]
+
+        prefix = f"{path}/" if path else ""
+        names = self.p4k._index.names
+        if not detail:
+            return [prefix + name for name in dirnames] + [names[i] for i in files]
+        return [self._dir_info(prefix + name) for name in dirnames] + [self._file_info(names[i], i) for i in files]
+
+    def find(self, path, maxdepth=None, withdirs=False, detail=False, **kwargs):
+        if maxdepth is not None or withdirs:
+            return super().find(path, maxdepth=maxdepth, withdirs=withdirs, detail=detail, **kwargs)
+
+        # every file beneath the path is a contiguous range of the sorted index
+        path = self._strip_protocol(path)
+        index = self.p4k._index
+        if path and path in index._name_lookup:
+            order = [index.index_of(path)]
+        else:
+            start, stop = index.prefix_range(f"{path}/" if path else "")
+            order = index.sorted_order[start:stop].tolist()
+        names = index.names
+        if detail:
+            return {names[i]: self._file_info(names[i], i) for i in order}
+        return [names[i] for i in order]
+
+    def _open(self, path, mode="rb", block_size=None, autocommit=True, cache_options=None, **kwargs):
+        if mode != "rb":
+            raise NotImplementedError("P4KFileSystem is read-only")
+        path = self._strip_protocol(path)
+        if path not in self.p4k._index._name_lookup and self.p4k._index.exists(path):
+            raise IsADirectoryError(path)
+        return P4KBufferedFile(self, path, block_size=block_size, **kwargs)
+
+    def cat_file(self, path, start=None, end=None, **kwargs):
+        path = self._strip_protocol(path)
+        reader = _P4KBlockReader(self, path)
+        try:
+            size = reader.info.file_size
+            start = 0 if start is None else (start if start >= 0 else max(size + start, 0))
+            end = size if end is None else (end if end >= 0 else max(size + end, 0))
+            return reader.read(start, end)
+        finally:
+            reader.close()
+
+    def ukey(self, path):
+        info = self.info(path)
+        return f"{info['name']}:{info.get('CRC')}:{info['size']}"
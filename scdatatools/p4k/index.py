@@ -0,0 +1,584 @@
+"""
+Columnar table of the entries in a P4K's central directory.
+
+Rather than creating a :class:`zipfile.ZipInfo` for every entry, :class:`P4KIndex` parses the central directory into
+a single :data:`P4K_INDEX_DTYPE` structured array and one NUL separated blob of entry names. The table, along with the
+order of its entries sorted by name, can also be persisted to a sidecar cache file which is keyed by the archive's size, modification time and the location of its
+central directory, so a stale cache is simply ignored and rebuilt.
+
+The index also records where the data of each entry begins, once it has been resolved from the entry's local file
+header, so entries can be read without parsing their local header again.
+"""
+
+import os
+import re
+import sys
+import struct
+import hashlib
+import zipfile
+import datetime
+from pathlib import Path
+
+import numpy as np
+
+
+P4K_INDEX_MAGIC = b"SCDTP4KI"
+P4K_INDEX_VERSION = 4
+
+# magic, version, archive size, archive mtime (ns), central directory offset, central directory size, entry count,
+# names length. Followed by the entries, their sorted order and the names
+_index_header = struct.Struct("<8sIQQQQQQ")
+
+_SORTED_ORDER_DTYPE = np.dtype("<i8")
+
+P4K_INDEX_DTYPE = np.dtype(
+    [
+        ("header_offset", "<u8"),
+        ("compress_size", "<u8"),
+        ("file_size", "<u8"),
+        ("CRC", "<u4"),
+        ("compress_type", "<u2"),
+        ("flag_bits", "<u2"),
+        ("time", "<u2"),
+        ("date", "<u2"),
+        ("create_version", "u1"),
+        ("create_system", "u1"),
+        ("extract_version", "u1"),
+        ("reserved", "u1"),
+        ("volume", "<u2"),
+        ("internal_attr", "<u2"),
+        ("external_attr", "<u4"),
+        ("is_encrypted", "?"),
+        # offset of the entry's data, past its local file header. 0 until it has been resolved
+        ("data_offset", "<u8"),
+    ]
+)
+
+# Mirrors zipfile.structCentralDir
+_CENTRAL_DIR_DTYPE = np.dtype(
+    [
+        ("signature", "S4"),
+        ("create_version", "u1"),
+        ("create_system", "u1"),
+        ("extract_version", "u1"),
+        ("reserved", "u1"),
+        ("flag_bits", "<u2"),
+        ("compress_type", "<u2"),
+        ("time", "<u2"),
+        ("date", "<u2"),
+        ("CRC", "<u4"),
+        ("compress_size", "<u4"),
+        ("file_size", "<u4"),
+        ("filename_length", "<u2"),
+        ("extra_length", "<u2"),
+        ("comment_length", "<u2"),
+        ("volume", "<u2"),
+        ("internal_attr", "<u2"),
+        ("external_attr", "<u4"),
+        ("header_offset", "<u4"),
+    ]
+)
+
+# Mirrors zipfile.structFileHeader
+_LOCAL_HEADER_DTYPE = np.dtype(
+    [
+        ("signature", "S4"),
+        ("extract_version", "u1"),
+        ("reserved", "u1"),
+        ("flag_bits", "<u2"),
+        ("compress_type", "<u2"),
+        ("time", "<u2"),
+        ("date", "<u2"),
+        ("CRC", "<u4"),
+        ("compress_size", "<u4"),
+        ("file_size", "<u4"),
+        ("filename_length", "<u2"),
+        ("extra_length", "<u2"),
+    ]
+)
+
+# P4K local file headers use their own signature, plain zip headers are accepted as well
+_LOCAL_HEADER_SIGNATURES = [b"PK\x03\x14", zipfile.stringFileHeader]
+
+# Leading ZIP64 extended information field of the extra data
+_ZIP64_EXTRA_DTYPE = np.dtype([("tag", "<u2"), ("length", "<u2"), ("counts", "<u8", (3,))])
+
+# P4K entries are flagged as encrypted by this byte of the extra data
+_P4K_ENCRYPTED_EXTRA_OFFSET = 168
+
+
+def _gather(data, offsets, dtype, chunk_size=65536):
+    """ Gather one `dtype` record from the uint8 array `data` at each of the `offsets`. Records that would extend past
+    the end of `data` are padded with the last byte of `data`. """
+    width = np.arange(dtype.itemsize)
+    out = np.empty((len(offsets), dtype.itemsize), dtype=np.uint8)
+    for i in range(0, len(offsets), chunk_size):
+        idx = offsets[i:i + chunk_size, None] + width
+        np.minimum(idx, len(data) - 1, out=idx)
+        out[i:i + chunk_size] = data[idx]
+    return out.view(dtype).reshape(-1)
+
+
+def literal_prefix(pattern) -> str:
+    """ Returns the leading portion of the glob `pattern` that contains no wildcards """
+    return re.split(r"[*?\[]", pattern, maxsplit=1)[0]
+
+
+def glob_to_regex(pattern, ignore_case=False):
+    """ Compile the posix glob `pattern` to a regex. Unlike :func:`fnmatch.translate`, `*` and `?` do not match
+    across path separators, while `**` matches any number of directories. """
+    res = []
+    parts = pattern.split("/")
+    for pos, part in enumerate(parts):
+        last = pos == len(parts) - 1
+        if part == "**":
+            res.append(".*" if last else "(?:.*/)?")
+            continue
+        i = 0
+        while i < len(part):
+            c = part[i]
+            i += 1
+            if c == "*":
+                res.append("[^/]*")
+            elif c == "?":
+                res.append("[^/]")
+            elif c == "[":
+                j = i
+                if part[j:j + 1] == "!":
+                    j += 1
+                if part[j:j + 1] == "]":
+                    j += 1
+                j = part.find("]", j)
+                if j < 0:
+                    res.append("\\[")
+                else:
+                    stuff = part[i:j].replace("\\", "\\\\")
+                    i = j + 1
+                    if stuff[0] == "!":
+                        stuff = "^/" + stuff[1:]
+                    elif stuff[0] == "^":
+                        stuff = "\\" + stuff
+                    res.append(f"[{stuff}]")
+            else:
+                res.append(re.escape(c))
+        if not last:
+            res.append("/")
+    return re.compile("".join(res) + r"\Z", flags=re.IGNORECASE if ignore_case else 0)
+
+
+def dos_timestamp(dt) -> int:
+    """ Pack the :class:`datetime.datetime` (or :class:`datetime.date`) `dt` into a 32 bit MS-DOS date and time, with
+    the date in the upper 16 bits, so packed timestamps can be compared as integers """
+    if not isinstance(dt, datetime.datetime):
+        dt = datetime.datetime(dt.year, dt.month, dt.day)
+    if dt.year < 1980:
+        return 0
+    return ((dt.year - 1980) << 25 | dt.month << 21 | dt.day << 16 | dt.hour << 11 | dt.minute << 5
+            | dt.second // 2)
+
+
+def _user_cache_dir() -> Path:
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", Path.home() / "AppData" / "Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(base) / "scdatatools"
+
+
+def default_index_cache_path(p4k_file) -> Path:
+    """ Returns the default location of the index cache for the P4K file `p4k_file` within the user's cache
+    directory. """
+    p4k_file = Path(p4k_file).absolute()
+    path_hash = hashlib.sha1(str(p4k_file).encode("utf-8")).hexdigest()[:16]
+    return _user_cache_dir() / "p4k" / f"{p4k_file.stem}-{path_hash}.p4kidx"
+
+
+def index_cache_key(fp, start_dir, size_cd) -> tuple:
+    """ Returns the key used to validate an index cache for the open P4K file object `fp`, or `None` if the file's
+    size and modification time cannot be determined.
+
+    :param fp: Open file object of the P4K
+    :param start_dir: Offset of the central directory
+    :param size_cd: Size of the central directory
+    """
+    try:
+        st = os.fstat(fp.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    return st.st_size, st.st_mtime_ns, start_dir, size_cd
+
+
+class P4KIndex:
+    """ Columnar table of the entries of a P4K file.
+
+    :param entries: :data:`P4K_INDEX_DTYPE` array with one record per entry
+    :param names_blob: UTF-8 encoded, NUL separated, original (non-normalized) names of the entries
+    """
+
+    def __init__(self, entries, names_blob: bytes):
+        self.entries = entries
+        self.names_blob = names_blob
+        self._name_ends = None
+        self._names = None
+        self._name_to_index = None
+        self._sorted_order = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def from_central_directory(cls, data: bytes, concat: int = 0) -> "P4KIndex":
+        """ Parse the raw bytes of a central directory into a :class:`P4KIndex`.
+
+        :param data: Bytes of the central directory
+        :param concat: Offset of the start of the archive within the file, added to every `header_offset`
+        """
+        # Central directory records are variable length, so walking them to find where each record starts (and
+        # slicing out the names along the way) is the only sequential step. Everything else is decoded in bulk.
+        lengths = struct.Struct("<HHH").unpack_from
+        size_cd = len(data)
+        offsets = []
+        names = []
+        pos = 0
+        try:
+            while pos < size_cd:
+                offsets.append(pos)
+                filename_length, extra_length, comment_length = lengths(data, pos + 28)
+                names.append(data[pos + 46:pos + 46 + filename_length])
+                pos += zipfile.sizeCentralDir + filename_length + extra_length + comment_length
+        except struct.error:
+            raise zipfile.BadZipFile("Truncated central directory")
+        if pos != size_cd:
+            raise zipfile.BadZipFile("Truncated central directory")
+
+        raw = np.frombuffer(data, dtype=np.uint8)
+        offsets = np.array(offsets, dtype=np.int64)
+        cd = _gather(raw, offsets, _CENTRAL_DIR_DTYPE)
+        if np.any(cd["signature"] != zipfile.stringCentralDir):
+            raise zipfile.BadZipFile("Bad magic number for central directory")
+        if np.any(cd["extract_version"] > zipfile.MAX_EXTRACT_VERSION):
+            raise NotImplementedError(
+                "zip file version %.1f" % (cd["extract_version"].max() / 10)
+            )
+
+        entries = np.zeros(len(cd), dtype=P4K_INDEX_DTYPE)
+        for field in P4K_INDEX_DTYPE.names:
+            if field not in ("is_encrypted", "data_offset"):
+                entries[field] = cd[field]
+
+        extra_offsets = offsets + zipfile.sizeCentralDir + cd["filename_length"]
+        extra_length = cd["extra_length"]
+        entries["is_encrypted"] = (extra_length > _P4K_ENCRYPTED_EXTRA_OFFSET) & (
+            raw[np.minimum(extra_offsets + _P4K_ENCRYPTED_EXTRA_OFFSET, max(len(raw) - 1, 0))] > 0
+        )
+
+        # Apply ZIP64 extended information when it is the first field of the extra data, as it is in P4K files.
+        # Any other layout is handled by the per entry decoder in `P4KInfo._decodeExtra`
+        zip64 = _gather(raw, extra_offsets, _ZIP64_EXTRA_DTYPE)
+        has_extra = extra_length >= 4
+        is_zip64 = has_extra & (zip64["tag"] == 1)
+        count = np.select([zip64["length"] >= 24, zip64["length"] == 16, zip64["length"] == 8], [3, 2, 1], 0)
+        valid_length = (zip64["length"] >= 24) | np.isin(zip64["length"], [0, 8, 16])
+        fallback = (has_extra & ~is_zip64) | (is_zip64 & ~valid_length)
+        rows = np.arange(len(entries))
+        idx = np.zeros(len(entries), dtype=np.int64)
+        for field in ("file_size", "compress_size", "header_offset"):
+            replace = is_zip64 & (entries[field] == 0xFFFFFFFF)
+            fallback |= replace & (idx >= count)
+            replace &= idx < count
+            entries[field] = np.where(replace, zip64["counts"][rows, np.minimum(idx, 2)], entries[field])
+            idx += replace
+
+        if np.all(cd["flag_bits"] & 0x800):
+            names_blob = b"\x00".join(names)
+        else:
+            names_blob = "\x00".join(
+                n.decode("utf-8" if f & 0x800 else "cp437") for n, f in zip(names, cd["flag_bits"].tolist())
+            ).encode("utf-8")
+        index = cls(entries, names_blob)
+
+        if np.any(fallback):
+            from scdatatools.p4k import P4KInfo
+
+            for i in np.flatnonzero(fallback).tolist():
+                x = P4KInfo._from_index_entry(index.orig_name(i), entries[i].item())
+                x.extra = data[extra_offsets[i]:extra_offsets[i] + extra_length[i]]
+                x._decodeExtra()
+                entries["file_size"][i] = x.file_size
+                entries["compress_size"][i] = x.compress_size
+                entries["header_offset"][i] = x.header_offset
+
+        entries["header_offset"] += concat
+        return index
+
+    @classmethod
+    def load(cls, path, key) -> "P4KIndex":
+        """ Load an index from the cache file at `path`. Returns `None` if the cache is missing, corrupt or was not
+        created with the same `key`. """
+        try:
+            with open(path, "rb") as f:
+                # read into a bytearray so the entries are writable and data offsets can be recorded
+                data = bytearray(os.fstat(f.fileno()).st_size)
+                if f.readinto(data) != len(data):
+                    return None
+        except OSError:
+            return None
+
+        if len(data) < _index_header.size:
+            return None
+        magic, version, *cache_key, count, names_len = _index_header.unpack_from(data)
+        if magic != P4K_INDEX_MAGIC or version != P4K_INDEX_VERSION or tuple(cache_key) != tuple(key):
+            return None
+
+        entries_len = count * P4K_INDEX_DTYPE.itemsize
+        order_len = count * _SORTED_ORDER_DTYPE.itemsize
+        if len(data) != _index_header.size + entries_len + order_len + names_len:
+            return None
+
+        entries = np.frombuffer(data, dtype=P4K_INDEX_DTYPE, count=count, offset=_index_header.size)
+        index = cls(entries, bytes(data[_index_header.size + entries_len + order_len:]))
+        index._sorted_order = np.frombuffer(
+            data, dtype=_SORTED_ORDER_DTYPE, count=count, offset=_index_header.size + entries_len
+        ).astype(np.int64, copy=False)
+        return index
+
+    def save(self, path, key) -> bool:
+        """ Save the index to the cache file at `path` for the archive identified by `key`. The cache is written to a
+        temporary file first so readers never see a partial cache. Returns `True` if the cache was written.
+
+        The :attr:`sorted_order` is saved as well, so the names of a large archive are only sorted once rather than by
+        every process that opens it. """
+        path = Path(path)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(
+                    _index_header.pack(
+                        P4K_INDEX_MAGIC, P4K_INDEX_VERSION, *key, len(self.entries), len(self.names_blob)
+                    )
+                )
+                f.write(np.ascontiguousarray(self.entries).tobytes())
+                f.write(self.sorted_order.astype(_SORTED_ORDER_DTYPE, copy=False).tobytes())
+                f.write(self.names_blob)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+            return False
+        return True
+
+    @property
+    def names(self) -> list:
+        """ Normalized (posix) names of every entry, in central directory order """
+        if self._names is None:
+            if len(self.entries):
+                self._names = self.names_blob.decode("utf-8").replace("\\", "/").split("\x00")
+            else:
+                self._names = []
+        return self._names
+
+    def orig_name(self, i) -> str:
+        """ Returns the original name of the entry `i` as it is stored in the P4K """
+        if self._name_ends is None:
+            self._name_ends = np.append(
+                np.flatnonzero(np.frombuffer(self.names_blob, dtype=np.uint8) == 0), len(self.names_blob)
+            )
+        start = self._name_ends[i - 1] + 1 if i > 0 else 0
+        return self.names_blob[start:self._name_ends[i]].decode("utf-8")
+
+    @property
+    def _name_lookup(self) -> dict:
+        if self._name_to_index is None:
+            self._name_to_index = dict(zip(self.names, range(len(self.entries))))
+        return self._name_to_index
+
+    def index_of(self, name) -> int:
+        """ Returns the index of the entry with the normalized `name`. Raises `KeyError` if there is no such entry """
+        return self._name_lookup[name]
+
+    def indices_of(self, names) -> np.ndarray:
+        """ Returns the index of the entry for each of the normalized `names`, or -1 for names that are not in the
+        P4K """
+        get = self._name_lookup.get
+        return np.fromiter((get(name, -1) for name in names), dtype=np.int64, count=len(names))
+
+    @property
+    def sorted_order(self) -> np.ndarray:
+        """ Entry indices sorted case-insensitively by name. Used to find all the entries beneath a path prefix """
+        if self._sorted_order is None:
+            names = self.names
+            self._sorted_order = np.array(sorted(range(len(names)), key=lambda i: names[i].lower()), dtype=np.int64)
+        return self._sorted_order
+
+    def _bisect(self, key) -> int:
+        """ Returns the first position in :attr:`sorted_order` whose lower case name is not less than `key` """
+        names = self.names
+        order = self.sorted_order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if names[order[mid]].lower() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def prefix_range(self, prefix) -> (int, int):
+        """ Returns the `(start, stop)` range of :attr:`sorted_order` containing every name that starts with
+        `prefix`, ignoring case. """
+        prefix = prefix.lower()
+        return self._bisect(prefix), self._bisect(prefix + "\U0010ffff")
+
+    def match(self, regex, prefix="") -> list:
+        """ Returns the names matching the compiled `regex`, in central directory order. Only names beginning with
+        `prefix` (ignoring case) are tested.  """
+        names = self.names
+        if not prefix:
+            return [name for name in names if regex.match(name)]
+        start, stop = self.prefix_range(prefix)
+        return [names[i] for i in np.sort(self.sorted_order[start:stop]).tolist() if regex.match(names[i])]
+
+    def match_indices(self, regex, prefix="") -> np.ndarray:
+        """ Like :meth:`match`, but returns the entry indices of the matching names """
+        names = self.names
+        if not prefix:
+            candidates = range(len(names))
+        else:
+            start, stop = self.prefix_range(prefix)
+            candidates = np.sort(self.sorted_order[start:stop]).tolist()
+        return np.fromiter((i for i in candidates if regex.match(names[i])), dtype=np.int64)
+
+    def query(self, indices=None, min_size=None, max_size=None, min_compress_size=None, max_compress_size=None,
+              min_ratio=None, max_ratio=None, encrypted=None, compress_type=None, modified_after=None,
+              modified_before=None) -> np.ndarray:
+        """ Returns the indices, in central directory order, of the entries matching every given condition. The
+        conditions are evaluated over the whole table at once.
+
+        :param indices: Only consider these entries, e.g. the result of :meth:`match_indices`
+        :param min_size: Minimum uncompressed size in bytes
+        :param max_size: Maximum uncompressed size in bytes
+        :param min_compress_size: Minimum compressed size in bytes
+        :param max_compress_size: Maximum compressed size in bytes
+        :param min_ratio: Minimum compression ratio, the compressed size divided by the uncompressed size. Empty
+            entries have a ratio of 1
+        :param max_ratio: Maximum compression ratio
+        :param encrypted: Only encrypted entries if `True`, only unencrypted entries if `False`
+        :param compress_type: Compression method, or a list of them
+        :param modified_after: Only entries modified after this :class:`datetime.datetime`
+        :param modified_before: Only entries modified before this :class:`datetime.datetime`
+        """
+        entries = self.entries if indices is None else self.entries[indices]
+        mask = np.ones(len(entries), dtype=bool)
+
+        for field, minimum, maximum in (("file_size", min_size, max_size),
+                                        ("compress_size", min_compress_size, max_compress_size)):
+            if minimum is not None:
+                mask &= entries[field] >= minimum
+            if maximum is not None:
+                mask &= entries[field] <= maximum
+
+        if min_ratio is not None or max_ratio is not None:
+            file_size = entries["file_size"].astype(np.float64)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = np.where(file_size > 0, entries["compress_size"] / file_size, 1.0)
+            if min_ratio is not None:
+                mask &= ratio >= min_ratio
+            if max_ratio is not None:
+                mask &= ratio <= max_ratio
+
+        if encrypted is not None:
+            mask &= entries["is_encrypted"] == bool(encrypted)
+
+        if compress_type is not None:
+            mask &= np.isin(entries["compress_type"], np.atleast_1d(compress_type))
+
+        if modified_after is not None or modified_before is not None:
+            timestamps = entries["date"].astype(np.uint32) << 16 | entries["time"]
+            if modified_after is not None:
+                mask &= timestamps > dos_timestamp(modified_after)
+            if modified_before is not None:
+                mask &= timestamps < dos_timestamp(modified_before)
+
+        matches = np.flatnonzero(mask)
+        return matches if indices is None else np.asarray(indices, dtype=np.int64)[matches]
+
+    def scandir(self, path) -> (list, list):
+        """ Returns a tuple of the names of the sub-directories and files directly within the directory `path`,
+        ignoring case. Raises `FileNotFoundError` if `path` is not a directory. """
+        path = path.strip("/")
+        dirs, files = self.scandir_indices(path)
+        start = len(path) + 1 if path else 0
+        names = self.names
+        return dirs, [names[i][start:] for i in files]
+
+    def scandir_indices(self, path) -> (list, list):
+        """ Like :meth:`scandir`, but returns the entry indices of the files instead of their names """
+        path = path.strip("/")
+        prefix = f"{path}/" if path else ""
+        names = self.names
+        order = self.sorted_order
+        start, stop = self.prefix_range(prefix)
+        if start == stop and prefix:
+            raise FileNotFoundError(f"No such directory in P4K: '{path}'")
+
+        dirs, files = [], []
+        pos = start
+        while pos < stop:
+            child, sep, _ = names[order[pos]][len(prefix):].partition("/")
+            if sep:
+                dirs.append(child)
+                # skip over everything within this sub-directory
+                pos = self._bisect(f"{prefix}{child}/".lower() + "\U0010ffff")
+            else:
+                files.append(int(order[pos]))
+                pos += 1
+        return dirs, files
+
+    def exists(self, path) -> bool:
+        """ Returns `True` if `path` is the name of an entry or of a directory containing entries, ignoring case """
+        path = path.strip("/").lower()
+        if not path:
+            return True
+        pos = self._bisect(path)
+        if pos < len(self.entries) and self.names[self.sorted_order[pos]].lower() == path:
+            return True
+        start, stop = self.prefix_range(f"{path}/")
+        return start != stop
+
+    def resolve_data_offsets(self, data) -> int:
+        """ Record the `data_offset` of every entry for which it is not yet known, by reading the local file headers
+        from `data`, a buffer of the entire P4K. Only the signatures of the headers are checked, the file names within
+        them are not compared to the central directory. Returns the number of entries that were resolved. """
+        pending = np.flatnonzero(self.entries["data_offset"] == 0)
+        if not len(pending):
+            return 0
+
+        raw = np.frombuffer(data, dtype=np.uint8)
+        try:
+            header_offsets = self.entries["header_offset"][pending].astype(np.int64)
+            if np.any(header_offsets + zipfile.sizeFileHeader > len(raw)):
+                raise zipfile.BadZipFile("Truncated file header")
+            headers = _gather(raw, header_offsets, _LOCAL_HEADER_DTYPE)
+        finally:
+            # release the export of `data`, so a memory map can be closed
+            del raw
+        if np.any(~np.isin(headers["signature"], _LOCAL_HEADER_SIGNATURES)):
+            raise zipfile.BadZipFile("Bad magic number for file header")
+
+        self.entries["data_offset"][pending] = (
+            header_offsets + zipfile.sizeFileHeader + headers["filename_length"] + headers["extra_length"]
+        )
+        return len(pending)
+
+    @property
+    def total_file_size(self) -> int:
+        """ Total uncompressed size of every entry """
+        return int(self.entries["file_size"].sum())
+
+    @property
+    def total_compress_size(self) -> int:
+        """ Total compressed size of every entry """
+        return int(self.entries["compress_size"].sum())
@@ -0,0 +1,149 @@
+import os
+import json
+import threading
+from pathlib import Path
+
+DEFAULT_EXTRACT_MANIFEST = ".scdt_extract_manifest.jsonl"
+
+
+class ExtractManifest:
+    """ Record of the P4K entries that have been extracted into a directory, used to skip unchanged entries when
+    re-extracting and to resume interrupted extractions.
+
+    The manifest is a JSON lines file with one record per extracted entry. Records are appended (and flushed) as
+    entries are extracted so an interrupted extraction loses at most the entries that were in flight. The manifest
+    is compacted when it is closed.
+
+    Records of `xml` entries are marked as `converted` once the entry has been converted to JSON, or found not to be
+    a CryXmlB file, so entries are extracted again if they were not converted and conversion is requested.
+
+    :param path: Path to the manifest file, it will be created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        self._fp = None
+        self._converted = set()
+        self._lock = threading.Lock()
+
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # most likely a partial line from an interrupted extraction
+                        continue
+                    self.entries[record["name"]] = record
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _record(member) -> dict:
+        return {
+            "name": member.filename,
+            "file_size": member.file_size,
+            "compress_size": member.compress_size,
+            "crc": member.CRC,
+            "date_time": list(member.date_time),
+        }
+
+    def _same_contents(self, name, member) -> bool:
+        """ Returns `True` if the entry `name` was recorded with the same contents as `member` """
+        record = self.entries.get(name)
+        return record is not None and (record["file_size"], record["compress_size"], record["crc"]) == (
+            member.file_size, member.compress_size, member.CRC)
+
+    def _is_recorded(self, member) -> bool:
+        """ Returns `True` if the latest record of `member` matches it """
+        record = self.entries.get(member.filename)
+        return record is not None and all(record.get(k) == v for k, v in self._record(member).items())
+
+    def is_current(self, member, targetpath, convert_cryxml=False) -> bool:
+        """ Returns `True` if `member` was previously extracted to `targetpath` and it has not changed since. If
+        `convert_cryxml` is set, `xml` members also have to have been converted. """
+        if not self._is_recorded(member):
+            return False
+        record = self.entries[member.filename]
+        if convert_cryxml and member.filename.lower().endswith("xml") and not record.get("converted"):
+            return False
+        if member.is_dir():
+            return os.path.isdir(targetpath)
+        if os.path.islink(targetpath):
+            # a symlinked duplicate shows the contents of its original, which has to still be the same file
+            link = record.get("link")
+            if link is None or not self._same_contents(link, member):
+                return False
+        try:
+            return os.path.getsize(targetpath) == member.file_size
+        except OSError:
+            return False
+
+    def outdated(self, members, targetpath, convert_cryxml=False) -> list:
+        """ Returns the `members` that have to be extracted, as they are not current (see :meth:`is_current`). A
+        symlinked duplicate is also outdated if its original is, so it is linked to the new original again.
+
+        :param members: List of :class:`P4KInfo`
+        :param targetpath: Function returning the path a member is extracted to
+        :param convert_cryxml: Whether CryXmlB files will be converted to JSON
+        """
+        changed = {m.filename for m in members if not self.is_current(m, targetpath(m), convert_cryxml)}
+        return [m for m in members
+                if m.filename in changed or self.entries[m.filename].get("link") in changed]
+
+    def _write(self, record):
+        if self._fp is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._fp = self.path.open("a", encoding="utf-8")
+        self.entries[record["name"]] = record
+        self._fp.write(json.dumps(record) + "\n")
+
+    def add(self, members, link=None):
+        """ Record the successfully extracted `members`. `link` is the name of the original the members were
+        symlinked to, if they are deduplicated symlinks. """
+        with self._lock:
+            for member in members:
+                record = self._record(member)
+                if link is not None:
+                    record["link"] = link
+                if member.filename in self._converted:
+                    record["converted"] = True
+                self._write(record)
+            self._fp.flush()
+
+    def add_duplicate(self, member, original, symlinked=False):
+        """ Record `member`, which was deduplicated by linking it, and its converted JSON, to the extracted
+        `original` """
+        with self._lock:
+            if original.filename in self._converted:
+                self._converted.add(member.filename)
+        self.add([member], link=original.filename if symlinked else None)
+
+    def converted(self, member):
+        """ Record that the extracted `xml` `member` was converted to JSON, or did not need to be """
+        with self._lock:
+            self._converted.add(member.filename)
+            # the member may have been recorded before the conversion finished
+            if self._is_recorded(member) and not self.entries[member.filename].get("converted"):
+                self._write(dict(self.entries[member.filename], converted=True))
+                self._fp.flush()
+
+    def close(self):
+        """ Close the manifest, rewriting it with only the latest record for each entry """
+        if self._fp is None:
+            return
+        self._fp.close()
+        self._fp = None
+
+        tmp = self.path.with_name(f"{self.path.name}.tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            for record in self.entries.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
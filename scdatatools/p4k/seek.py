@@ -0,0 +1,80 @@
+import bisect
+
+import zstandard as zstd
+
+_ZSTD_FRAME_MAGIC = b"\x28\xb5\x2f\xfd"
+_ZSTD_BLOCK_RLE = 1
+
+
+class ZstdSeekPoints:
+    """ The known starts of the zstd frames of a P4K entry, as pairs of offsets into the uncompressed and compressed
+    data. Decompression can be restarted at any frame, so a seek only has to decompress from the nearest preceding
+    frame instead of from the start of the entry.
+
+    Points are only ever discovered in order, either by :func:`scan_zstd_frames` or while an entry is being read, so
+    the known points are always a prefix of the entry's frames.
+
+    :param on_add: Called with this object the first time a point, other than the start of the entry, is added
+    """
+
+    def __init__(self, on_add=None):
+        self.uncompressed = [0]
+        self.compressed = [0]
+        self._on_add = on_add
+
+    def __len__(self):
+        return len(self.uncompressed)
+
+    def add(self, uncompressed_offset, compressed_offset):
+        """ Add the frame starting at `compressed_offset`, whose data starts at `uncompressed_offset` """
+        if uncompressed_offset <= self.uncompressed[-1] or compressed_offset <= self.compressed[-1]:
+            return
+        self.uncompressed.append(uncompressed_offset)
+        self.compressed.append(compressed_offset)
+        if self._on_add is not None:
+            self._on_add(self)
+            self._on_add = None
+
+    def find(self, pos):
+        """ Returns the `(uncompressed_offset, compressed_offset)` of the last known frame starting at or before the
+        uncompressed position `pos` """
+        i = bisect.bisect_right(self.uncompressed, pos) - 1
+        return self.uncompressed[i], self.compressed[i]
+
+
+def scan_zstd_frames(data, seek_points=None) -> ZstdSeekPoints:
+    """ Find the frames of the (decrypted) zstd stream `data` by walking the frame and block headers, without
+    decompressing anything. Scanning stops at the first frame that does not record its content size, as the
+    uncompressed offsets of the frames that follow it are unknown, or at the padding after the last frame.
+
+    :param data: The compressed data of the entry
+    :param seek_points: :class:`ZstdSeekPoints` to add the frames to, a new one is created if not given
+    """
+    if seek_points is None:
+        seek_points = ZstdSeekPoints()
+    data = memoryview(data)
+    compressed_offset = uncompressed_offset = 0
+    while data[compressed_offset:compressed_offset + 4] == _ZSTD_FRAME_MAGIC:
+        frame = data[compressed_offset:]
+        try:
+            params = zstd.get_frame_parameters(frame)
+            pos = zstd.frame_header_size(frame)
+        except zstd.ZstdError:
+            break
+
+        last_block = False
+        while not last_block:
+            if pos + 3 > len(frame):
+                return seek_points
+            header = int.from_bytes(frame[pos:pos + 3], "little")
+            last_block = header & 1
+            pos += 3 + (1 if (header >> 1) & 3 == _ZSTD_BLOCK_RLE else header >> 3)
+        if params.has_checksum:
+            pos += 4
+
+        seek_points.add(uncompressed_offset, compressed_offset)
+        if params.content_size == zstd.CONTENTSIZE_UNKNOWN:
+            break
+        compressed_offset += pos
+        uncompressed_offset += params.content_size
+    return seek_points
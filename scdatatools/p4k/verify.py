@@ -0,0 +1,213 @@
+import os
+import time
+import hashlib
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from scdatatools.p4k import P4KFile
+from scdatatools.p4k.diff import P4KDiff
+
+DIGEST_ALGORITHMS = ["blake2b", "sha256", "xxh3_128"]
+DEFAULT_DIGEST_ALGORITHM = "blake2b"
+
+P4K_MANIFEST_HEADER = "# scdatatools p4k manifest v1"
+
+# entries larger than this are hashed in chunks instead of being decompressed in one go
+_STREAM_SIZE = 64 * 1024 * 1024
+
+_worker_local = threading.local()
+
+
+def new_digest(algorithm=DEFAULT_DIGEST_ALGORITHM):
+    """ Returns a new hash object for `algorithm`, one of :data:`DIGEST_ALGORITHMS`. `xxh3_128` requires the
+    `xxhash` package. """
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    if algorithm == "sha256":
+        return hashlib.sha256()
+    if algorithm == "xxh3_128":
+        if xxhash is None:
+            raise ImportError("The xxhash package is required for xxh3_128 digests, install the xxhash extra")
+        return xxhash.xxh3_128()
+    raise ValueError(f"Unsupported digest algorithm {algorithm}, expected one of {DIGEST_ALGORITHMS}")
+
+
+class P4KManifest:
+    """ Digests of the contents of the files in a P4K, as created by :func:`build_manifest`. Manifests can be saved
+    and compared, to check a P4K against a known good copy or to find the files that changed between builds.
+
+    The saved manifest is a text file with a header line naming the algorithm, followed by a
+    `<digest> <file size> <name>` line for every file, sorted by name.
+
+    :ivar algorithm: Digest algorithm used, one of :data:`DIGEST_ALGORITHMS`
+    :ivar digests: Dict of file name to a `(file_size, hexdigest)` tuple
+    :ivar errors: Dict of file name to the error encountered reading it, for files that are corrupt
+    :ivar total_bytes: Total uncompressed bytes hashed
+    :ivar seconds: Time taken to build the manifest
+    """
+
+    def __init__(self, algorithm=DEFAULT_DIGEST_ALGORITHM, digests=None, errors=None, total_bytes=0, seconds=0.0):
+        self.algorithm = algorithm
+        self.digests = digests or {}
+        self.errors = errors or {}
+        self.total_bytes = total_bytes
+        self.seconds = seconds
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.total_bytes / (1024 * 1024) / self.seconds if self.seconds else 0.0
+
+    @classmethod
+    def load(cls, path) -> "P4KManifest":
+        """ Load a manifest saved with :meth:`save` """
+        digests = {}
+        with open(path, "r", encoding="utf-8") as f:
+            header = f.readline().rstrip("\n")
+            if not header.startswith(P4K_MANIFEST_HEADER):
+                raise ValueError(f"{path} is not a P4K manifest")
+            algorithm = header[len(P4K_MANIFEST_HEADER):].strip()
+            for line in f:
+                digest, file_size, name = line.rstrip("\n").split(" ", 2)
+                digests[name] = (int(file_size), digest)
+        return cls(algorithm, digests)
+
+    def save(self, path):
+        """ Save the manifest to `path`, or write it to `path` if it is a text file object """
+        if hasattr(path, "write"):
+            path.write(f"{P4K_MANIFEST_HEADER} {self.algorithm}\n")
+            for name in sorted(self.digests):
+                file_size, digest = self.digests[name]
+                path.write(f"{digest} {file_size} {name}\n")
+            return
+
+        path = Path(path)
+        tmp = path.with_name(f"{path.name}.tmp")
+        with tmp.open("w", encoding="utf-8", newline="\n") as f:
+            self.save(f)
+        os.replace(tmp, path)
+
+    def compare(self, other) -> P4KDiff:
+        """ Compare against the `other`, older, manifest. Both manifests must use the same algorithm. """
+        if self.algorithm != other.algorithm:
+            raise ValueError(f"Cannot compare {self.algorithm} digests to {other.algorithm} digests")
+        changed = [name for name, digest in self.digests.items() if name in other.digests
+                   and other.digests[name] != digest]
+        added = [name for name in self.digests if name not in other.digests]
+        return P4KDiff(
+            added=added,
+            removed=[name for name in other.digests if name not in self.digests],
+            changed=changed,
+            unchanged=len(self.digests) - len(added) - len(changed),
+        )
+
+    def __repr__(self):
+        return (
+            f"<P4KManifest {self.algorithm} files:{len(self.digests)} errors:{len(self.errors)} "
+            f"{self.mb_per_second:.1f}MB/s>"
+        )
+
+
+class _P4KHashWorker:
+    """ Hashes batches of :class:`P4KInfo`. Threads share the given :class:`P4KFile`, worker processes open the P4K
+    once each. """
+
+    def __init__(self, p4k, algorithm):
+        self.algorithm = algorithm
+        self.p4k = p4k
+
+    def __getstate__(self):
+        # processes are given the path of the P4K, not the open P4KFile
+        state = self.__dict__.copy()
+        state["p4k"] = (self.p4k.filename, self.p4k.key, self.p4k._index_cache)
+        return state
+
+    def _get_p4k(self) -> P4KFile:
+        if isinstance(self.p4k, P4KFile):
+            return self.p4k
+        p4ks = getattr(_worker_local, "p4ks", None)
+        if p4ks is None:
+            p4ks = _worker_local.p4ks = {}
+        if self.p4k not in p4ks:
+            filename, key, index_cache = self.p4k
+            p4ks[self.p4k] = P4KFile(filename, key=key, index_cache=index_cache)
+        return p4ks[self.p4k]
+
+    def _hash(self, p4k, member) -> str:
+        digest = new_digest(self.algorithm)
+        size = 0
+        if member.file_size > _STREAM_SIZE:
+            for chunk in p4k.iter_chunks(member):
+                digest.update(chunk)
+                size += len(chunk)
+        else:
+            data = p4k.read_bytes(member)
+            digest.update(data)
+            size = len(data)
+        if size != member.file_size:
+            raise ValueError(f"Read {size} bytes, expected {member.file_size}")
+        return digest.hexdigest()
+
+    def __call__(self, members) -> list:
+        """ Returns a `(member, hexdigest, error)` tuple for each of `members` """
+        p4k = self._get_p4k()
+        results = []
+        for member in members:
+            try:
+                results.append((member, self._hash(p4k, member), None))
+            except Exception as e:
+                results.append((member, None, f"{type(e).__name__}: {e}"))
+        return results
+
+
+def build_manifest(p4k, members=None, algorithm=DEFAULT_DIGEST_ALGORITHM, workers=0, use_processes=False,
+                   batch_size=64, on_error=None) -> P4KManifest:
+    """ Decrypt, decompress and hash every file in `p4k`, verifying that each can be read and has the expected size.
+    Files are hashed in batches by a pool of `workers` threads (or processes if `use_processes`), in the order they
+    are stored in the P4K so it is read sequentially. zstd, AES and the digests release the GIL, so threads scale
+    well for all but the smallest files.
+
+    The CRCs stored in P4K files are not those of the decompressed contents, so they cannot be checked. Compare the
+    returned :class:`P4KManifest` to one of a known good copy of the P4K instead.
+
+    :param p4k: :class:`P4KFile` to hash
+    :param members: :class:`P4KInfo` of the files to hash, defaults to every file
+    :param algorithm: Digest algorithm, one of :data:`DIGEST_ALGORITHMS`
+    :param workers: Number of workers, 0 for one worker per CPU
+    :param use_processes: Hash in worker processes instead of threads, requires `p4k` to be opened from a file name
+    :param batch_size: Number of files given to a worker at a time
+    :param on_error: Called with the name of a file and the error message when a file cannot be read
+    """
+    new_digest(algorithm)  # fail early for an unsupported or unavailable algorithm
+    if use_processes and not p4k.filename:
+        raise ValueError("Hashing in worker processes requires a P4KFile opened from a file name")
+    if members is None:
+        members = p4k.infolist()
+    members = sorted((m for m in members if not m.is_dir()), key=lambda m: m.header_offset)
+    workers = workers or os.cpu_count() or 1
+    batches = [members[i:i + batch_size] for i in range(0, len(members), batch_size)]
+
+    manifest = P4KManifest(algorithm)
+    start = time.perf_counter()
+    hasher = _P4KHashWorker(p4k, algorithm)
+    if use_processes:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    with executor:
+        for results in executor.map(hasher, batches):
+            for member, digest, error in results:
+                if error is not None:
+                    manifest.errors[member.filename] = error
+                    if on_error is not None:
+                        on_error(member.filename, error)
+                else:
+                    manifest.digests[member.filename] = (member.file_size, digest)
+                    manifest.total_bytes += member.file_size
+    manifest.seconds = time.perf_counter() - start
+    return manifest
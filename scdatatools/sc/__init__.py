@@ -16,7 +16,7 @@ TRY_VERSION_FILES = ['f_win_game_client_release.id', 'c_hiload_crash_handler.id'
 
 
 class StarCitizen:
-    def __init__(self, game_folder, p4k_file='Data.p4k'):
+    def __init__(self, game_folder, p4k_file='Data.p4k', p4k_content_cache=None):
         self.branch = self.build_time_stamp = self.config = self.version = None
         self.version_label = self.shelved_change = self.tag = None
         self._fetch_label_success = False
@@ -26,6 +26,7 @@ class StarCitizen:
             raise ValueError(f'{self.game_folder} is not a directory')
 
         self._p4k = None
+        self._p4k_content_cache = p4k_content_cache
         self.p4k_file = self.game_folder / p4k_file
         if not self.p4k_file.is_file():
             raise ValueError(f'Could not find p4k file {self.p4k_file}')
@@ -72,7 +73,7 @@ class StarCitizen:
     @property
     def p4k(self):
         if self._p4k is None:
-            self._p4k = P4KFile(self.p4k_file)
+            self._p4k = P4KFile(self.p4k_file, index_cache=True, content_cache=self._p4k_content_cache)
         return self._p4k
 
     @property
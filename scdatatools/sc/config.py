@@ -8,9 +8,8 @@ class Profile:
     def __init__(self, sc, p4k_path):
         self.sc = sc
 
-        with self.sc.p4k.open(p4k_path) as f:
-            self.xml = etree_from_cryxml_file(f)
-            self.json = etree_to_dict(self.xml)
+        self.xml = etree_from_cryxml_file(self.sc.p4k.read_bytes(p4k_path))
+        self.json = etree_to_dict(self.xml)
 
     def actionmap(self, language=None):
         m = {}
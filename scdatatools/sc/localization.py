@@ -8,12 +8,11 @@ class SCLocalization:
         self.languages = []
         self.translations = {}
         for l in self.p4k.search('Data/Localization/*/global.ini'):
-            with self.p4k.open(l) as f:
-                lang = l.split('/')[2]
-                self.languages.append(lang)
-                self.translations[lang] = dict(
-                    _.split('=', 1) for _ in f.read().decode('utf-8').split('\r\n') if _
-                )
+            lang = l.split('/')[2]
+            self.languages.append(lang)
+            self.translations[lang] = dict(
+                _.split('=', 1) for _ in self.p4k.read_bytes(l).decode('utf-8').split('\r\n') if _
+            )
 
     def gettext(self, key, language=None):
         language = self.default_language if (language is None or language not in self.languages) else language
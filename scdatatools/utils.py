@@ -90,3 +90,17 @@ def dict_to_etree(d: dict) -> ElementTree:
     node = ElementTree.Element(tag)
     _to_etree(body, node)
     return node
+
+
+_SIZE_UNITS = {"": 1, "B": 1, "K": 1024, "KB": 1024, "M": 1024 ** 2, "MB": 1024 ** 2, "G": 1024 ** 3, "GB": 1024 ** 3}
+
+
+def parse_size(size) -> int:
+    """ Parse a human readable size such as `512`, `64KB` or `1.5G` into bytes. Units are binary, so `1KB` is 1024
+    bytes. """
+    size = str(size).strip().upper()
+    number = size.rstrip("KMGB")
+    unit = size[len(number):]
+    if unit not in _SIZE_UNITS:
+        raise ValueError(f"Invalid size: {size}")
+    return int(float(number) * _SIZE_UNITS[unit])
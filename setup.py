@@ -14,7 +14,8 @@ with open('HISTORY.rst') as history_file:
 requirements = [
     "pyrsi~=0.1.0",
     "pycryptodome~=3.9.0",
-    "zstandard~=0.12.0",
+    "zstandard~=0.15",
+    "numpy",
     "python-nubia==0.2b2",
     "ipython"
 ]
@@ -24,7 +25,12 @@ setup_requirements = [
     "sphinx==3.0.3"
 ]
 
-test_requirements = []
+test_requirements = ["pytest"]
+
+extras_requirements = {
+    "fsspec": ["fsspec"],
+    "xxhash": ["xxhash>=2.0"],
+}
 
 
 if len(sys.argv) >= 2 and sys.argv[1] == 'docs':
@@ -67,14 +73,16 @@ setup(
     ],
     description="Python tools for working with Star Citizen data files.",
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="MIT license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
     keywords='scdatatools',
     name='scdatatools',
-    packages=find_packages(include=['scdatatools']),
+    packages=find_packages(include=['scdatatools', 'scdatatools.*']),
     entry_points={
         'console_scripts': ['scdt=scdatatools.cli:main'],
+        'fsspec.specs': ['p4k=scdatatools.p4k.fs.P4KFileSystem'],
     },
     setup_requires=setup_requirements,
     test_suite='tests',
@@ -0,0 +1,86 @@
+""" Builders of small P4K and CryXMLB files for the tests """
+import struct
+import zipfile
+
+import zstandard as zstd
+
+_CRYXMLB_HEADER = struct.Struct("<8s9I")
+_CRYXMLB_NODE = struct.Struct("<IIHHIIII")
+_CRYXMLB_ATTRIBUTE = struct.Struct("<II")
+
+
+def _p4k_extra(file_size, compress_size, header_offset):
+    # zip64 sizes followed by CIG's extra field, which holds the encryption flag
+    zip64 = struct.pack("<HHQQQ", 1, 24, file_size, compress_size, header_offset)
+    padding = 170 - len(zip64) - 4
+    return zip64 + struct.pack("<HH", 0x5000, padding) + bytes(padding)
+
+
+def build_p4k(path, files):
+    """ Write a P4K of the zstd compressed, unencrypted, `files`, a dict of file name to contents """
+    cctx = zstd.ZstdCompressor()
+    central_directory = []
+    with open(path, "wb") as f:
+        for name, data in files.items():
+            offset = f.tell()
+            payload = cctx.compress(data)
+            filename = name.encode("utf-8")
+            crc = zipfile.crc32(data)
+            extra = _p4k_extra(len(data), len(payload), offset)
+            f.write(struct.pack(zipfile.structFileHeader, b"PK\x03\x14", 45, 0, 0x800, 100, 0x6000, 0x5221, crc,
+                                0xFFFFFFFF, 0xFFFFFFFF, len(filename), len(extra)))
+            f.write(filename + extra + payload)
+            central_directory.append((filename, extra, crc))
+
+        start = f.tell()
+        for filename, extra, crc in central_directory:
+            f.write(struct.pack(zipfile.structCentralDir, zipfile.stringCentralDir, 45, 0, 45, 0, 0x800, 100, 0x6000,
+                                0x5221, crc, 0xFFFFFFFF, 0xFFFFFFFF, len(filename), len(extra), 0, 0, 0, 0,
+                                0xFFFFFFFF))
+            f.write(filename + extra)
+        end = f.tell()
+        count = len(central_directory)
+        f.write(struct.pack(zipfile.structEndArchive64, zipfile.stringEndArchive64, 44, 45, 45, 0, 0, count, count,
+                            end - start, start))
+        f.write(struct.pack(zipfile.structEndArchive64Locator, zipfile.stringEndArchive64Locator, 0, end, 1))
+        f.write(struct.pack(zipfile.structEndArchive, zipfile.stringEndArchive, 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF,
+                            0xFFFFFFFF, 0))
+
+
+def encode_cryxmlb(root) -> bytes:
+    """ Returns the :class:`ElementTree.Element` `root` encoded as a CryXMLB file """
+    string_offsets = {}
+    string_data = bytearray()
+
+    def string(s):
+        if s not in string_offsets:
+            string_offsets[s] = len(string_data)
+            string_data.extend(s.encode("utf-8") + b"\x00")
+        return string_offsets[s]
+
+    # breadth first, so the children of each node are contiguous in the child table
+    elements = [(root, 0xFFFFFFFF)]
+    for index, (element, _) in enumerate(elements):
+        elements.extend((child, index) for child in element)
+    indices = {id(element): index for index, (element, _) in enumerate(elements)}
+
+    nodes, attributes, children = [], [], []
+    for element, parent in elements:
+        nodes.append((string(element.tag), string(element.text or ""), len(element.attrib), len(element), parent,
+                      len(attributes), len(children), 0))
+        attributes.extend((string(k), string(v)) for k, v in element.attrib.items())
+        children.extend(indices[id(child)] for child in element)
+
+    node_offset = _CRYXMLB_HEADER.size
+    attribute_offset = node_offset + _CRYXMLB_NODE.size * len(nodes)
+    child_offset = attribute_offset + _CRYXMLB_ATTRIBUTE.size * len(attributes)
+    string_offset = child_offset + 4 * len(children)
+    data = bytearray(_CRYXMLB_HEADER.pack(b"CryXmlB\x00", string_offset + len(string_data), node_offset, len(nodes),
+                                          attribute_offset, len(attributes), child_offset, len(children),
+                                          string_offset, len(string_data)))
+    for node in nodes:
+        data += _CRYXMLB_NODE.pack(*node)
+    for attribute in attributes:
+        data += _CRYXMLB_ATTRIBUTE.pack(*attribute)
+    data += struct.pack(f"<{len(children)}I", *children)
+    return bytes(data + string_data)
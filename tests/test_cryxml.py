@@ -0,0 +1,92 @@
+import io
+import json
+from xml.etree import ElementTree
+
+import pytest
+
+from scdatatools.cryxml import (
+    etree_from_cryxml_file, dict_from_cryxml_file, json_from_cryxml_file, iterparse_cryxml, CryXMLBStringCache
+)
+from scdatatools.utils import etree_to_dict
+from tests.helpers import encode_cryxmlb
+
+
+def _tree(root_tag="Root", child_tags=("Item", "Item", "Part")):
+    root = ElementTree.Element(root_tag, {"version": "1"})
+    for i, tag in enumerate(child_tags):
+        child = ElementTree.SubElement(root, tag, {"index": str(i)})
+        child.text = f"  text {i} "
+        ElementTree.SubElement(child, "Leaf").text = "value"
+        ElementTree.SubElement(child, "Empty")
+    ElementTree.SubElement(root, "Blank").text = "   "
+    return root
+
+
+@pytest.mark.parametrize("root_tag,child_tags", [
+    ("Root", ("Item", "Item", "Part")),
+    ("{x}Root", ("{x}a", "{x}a", "c}d")),
+])
+def test_dict_and_json_match_etree(root_tag, child_tags):
+    data = encode_cryxmlb(_tree(root_tag, child_tags))
+    expected = etree_to_dict(etree_from_cryxml_file(data))
+    assert dict_from_cryxml_file(data) == expected
+    for indent in (4, None):
+        for sort_keys in (False, True):
+            assert json_from_cryxml_file(data, indent=indent, sort_keys=sort_keys) == json.dumps(
+                expected, indent=indent, sort_keys=sort_keys)
+
+
+def test_deep_file():
+    depth = 5000
+    root = element = ElementTree.Element("Root")
+    for i in range(depth):
+        element = ElementTree.SubElement(element, "Item", {"i": str(i)})
+    data = encode_cryxmlb(root)
+
+    d = dict_from_cryxml_file(data)["Root"]["Item"]
+    for i in range(depth - 1):
+        assert d["@i"] == str(i)
+        d = d["Item"]
+    assert d == {"@i": str(depth - 1)}
+
+    expected = (
+        '{"Root": {"Item": ' + '{"Item": ' * (depth - 1) + f'{{"@i": "{depth - 1}"}}'
+        + "".join(f', "@i": "{i}"}}' for i in reversed(range(depth - 1))) + "}}"
+    )
+    assert json_from_cryxml_file(data, indent=None) == expected
+
+
+def test_iterparse_matches_etree():
+    data = encode_cryxmlb(_tree())
+    expected = [(event, element.tag) for event, element in ElementTree.iterparse(
+        io.BytesIO(ElementTree.tostring(etree_from_cryxml_file(data).getroot())), ("start", "end"))]
+    assert [(event, element.tag) for event, element in iterparse_cryxml(data, ("start", "end"))] == expected
+
+
+def test_iterparse_deep_file():
+    depth = 5000
+    root = element = ElementTree.Element("Root")
+    for i in range(depth):
+        element = ElementTree.SubElement(element, "Item", {"i": str(i)})
+    data = encode_cryxmlb(root)
+
+    ends = [element.get("i") for event, element in iterparse_cryxml(data)]
+    assert ends == [str(i) for i in reversed(range(depth))] + [None]
+    assert len(list(etree_from_cryxml_file(data).iter("Item"))) == depth
+
+
+def test_string_cache():
+    cache = CryXMLBStringCache(max_bytes=1024)
+    first = cache.decode(b"Item" * 4)
+    assert cache.decode(b"Item" * 4) is first
+    assert cache.decode(b"Item" * 4, "latin-1") == first
+    assert len(cache) == 2 and 0 < cache.size <= 1024
+
+    # the cache is cleared instead of growing past its budget
+    for i in range(100):
+        assert cache.decode(f"value {i}".encode()) == f"value {i}"
+        assert cache.size <= 1024
+    assert len(cache) < 100
+
+    cache.clear()
+    assert len(cache) == 0 and cache.size == 0
@@ -0,0 +1,76 @@
+import json
+from xml.etree import ElementTree
+
+import pytest
+
+from scdatatools.p4k import P4KFile, DEFAULT_EXTRACT_MANIFEST
+from tests.helpers import build_p4k, encode_cryxmlb
+
+
+def _cryxmlb(value):
+    return encode_cryxmlb(ElementTree.Element("Root", {"value": value}))
+
+
+@pytest.mark.parametrize("dedupe,incremental", [("symlink", False), ("hardlink", False), ("hardlink", True)])
+def test_reextract_over_deduplicated_files(tmp_path, dedupe, incremental):
+    output = tmp_path / "out"
+    manifest = output / DEFAULT_EXTRACT_MANIFEST if incremental else None
+
+    # a and b are identical in the first version, so b is extracted as a link to a
+    build_p4k(tmp_path / "v1.p4k", {
+        "Data/a.txt": b"same" * 100,
+        "Data/b.txt": b"same" * 100,
+        "Data/a.xml": _cryxmlb("same"),
+        "Data/b.xml": _cryxmlb("same"),
+    })
+    P4KFile(str(tmp_path / "v1.p4k")).extractall(str(output), dedupe=dedupe, manifest=manifest,
+                                                 convert_cryxml=True, cryxml_workers=None)
+
+    # only b changes in the second version
+    build_p4k(tmp_path / "v2.p4k", {
+        "Data/a.txt": b"same" * 100,
+        "Data/b.txt": b"changed" * 100,
+        "Data/a.xml": _cryxmlb("same"),
+        "Data/b.xml": _cryxmlb("changed"),
+    })
+    P4KFile(str(tmp_path / "v2.p4k")).extractall(str(output), dedupe=dedupe, manifest=manifest,
+                                                 convert_cryxml=True, cryxml_workers=None)
+
+    assert (output / "Data/a.txt").read_bytes() == b"same" * 100
+    assert (output / "Data/b.txt").read_bytes() == b"changed" * 100
+    assert (output / "Data/a.xml").read_bytes() == _cryxmlb("same")
+    assert (output / "Data/b.xml").read_bytes() == _cryxmlb("changed")
+    assert json.loads((output / "Data/a.json").read_text()) == {"Root": {"@value": "same"}}
+    assert json.loads((output / "Data/b.json").read_text()) == {"Root": {"@value": "changed"}}
+
+
+@pytest.mark.parametrize("dedupe", ["symlink", "hardlink"])
+def test_incremental_reextract_when_original_changes(tmp_path, dedupe):
+    output = tmp_path / "out"
+    manifest = output / DEFAULT_EXTRACT_MANIFEST
+
+    def extract(version, a):
+        build_p4k(tmp_path / f"{version}.p4k", {
+            "Data/a.txt": a * 100,
+            "Data/b.txt": b"same" * 100,
+            "Data/a.xml": _cryxmlb(a.decode()),
+            "Data/b.xml": _cryxmlb("same"),
+        })
+        P4KFile(str(tmp_path / f"{version}.p4k")).extractall(str(output), dedupe=dedupe, manifest=manifest,
+                                                             convert_cryxml=True, cryxml_workers=None)
+
+    # b is extracted as a link to a, which is left alone while a is unchanged
+    extract("v1", b"same")
+    assert (output / "Data/b.txt").samefile(output / "Data/a.txt")
+    mtime = (output / "Data/b.txt").lstat().st_mtime_ns
+    extract("v1", b"same")
+    assert (output / "Data/b.txt").lstat().st_mtime_ns == mtime
+
+    # then only a changes, keeping the same size
+    extract("v2", b"SAME")
+    assert (output / "Data/a.txt").read_bytes() == b"SAME" * 100
+    assert (output / "Data/b.txt").read_bytes() == b"same" * 100
+    assert (output / "Data/a.xml").read_bytes() == _cryxmlb("SAME")
+    assert (output / "Data/b.xml").read_bytes() == _cryxmlb("same")
+    assert json.loads((output / "Data/a.json").read_text()) == {"Root": {"@value": "SAME"}}
+    assert json.loads((output / "Data/b.json").read_text()) == {"Root": {"@value": "same"}}
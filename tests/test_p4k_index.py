@@ -0,0 +1,21 @@
+import numpy as np
+
+from scdatatools.p4k import P4KFile
+from tests.helpers import build_p4k
+
+
+def test_index_cache_keeps_sorted_order(tmp_path):
+    names = ["Data/b.txt", "Data/A.txt", "data/c.xml", "Data/Sub/d.txt", "Data/a.dds"]
+    build_p4k(tmp_path / "data.p4k", {name: name.encode() for name in names})
+    cache = tmp_path / "data.p4k.idx"
+
+    with P4KFile(str(tmp_path / "data.p4k"), index_cache=str(cache)) as p4k:
+        order = p4k._index.sorted_order
+        assert [p4k._index.names[i] for i in order] == sorted(names, key=str.lower)
+        expected = p4k.search("data/*.txt")
+
+    # the order is loaded from the cache rather than sorted again
+    with P4KFile(str(tmp_path / "data.p4k"), index_cache=str(cache)) as p4k:
+        assert p4k._index._sorted_order is not None
+        assert np.array_equal(p4k._index.sorted_order, order)
+        assert p4k.search("data/*.txt") == expected
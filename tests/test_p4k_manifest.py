@@ -0,0 +1,49 @@
+import json
+from xml.etree import ElementTree
+
+import pytest
+
+from scdatatools.p4k import P4KFile, DEFAULT_EXTRACT_MANIFEST
+from scdatatools.p4k.manifest import ExtractManifest
+from tests.helpers import build_p4k, encode_cryxmlb
+
+EXTRACT_MODES = {
+    "sequential": {},
+    "threads": {"workers": 2, "batch_size": 1},
+    "processes": {"workers": 2, "batch_size": 1, "use_processes": True},
+    "pipelined": {"pipelined": True, "workers": 2},
+}
+
+
+@pytest.mark.parametrize("mode", EXTRACT_MODES)
+def test_convert_after_incremental_extraction(tmp_path, mode):
+    output = tmp_path / "out"
+    manifest = output / DEFAULT_EXTRACT_MANIFEST
+    build_p4k(tmp_path / "data.p4k", {
+        "Data/a.xml": encode_cryxmlb(ElementTree.Element("Root", {"value": "a"})),
+        "Data/plain.xml": b"<Root />",
+        "Data/broken.xml": b"CryXmlB\0" + b"\xff" * 64,
+        "Data/a.txt": b"text",
+    })
+
+    def extract(**kwargs):
+        p4k = P4KFile(str(tmp_path / "data.p4k"))
+        p4k.extractall(str(output), manifest=manifest, cryxml_workers=None, **EXTRACT_MODES[mode], **kwargs)
+        return ExtractManifest(manifest)
+
+    extract()
+    assert not (output / "Data/a.json").exists()
+
+    # the previous extraction did not convert anything, so the xml files are extracted and converted now
+    records = extract(convert_cryxml=True).entries
+    assert json.loads((output / "Data/a.json").read_text()) == {"Root": {"@value": "a"}}
+    assert records["Data/a.xml"].get("converted")
+    assert records["Data/plain.xml"].get("converted")
+    assert not records["Data/broken.xml"].get("converted")
+    assert not records["Data/a.txt"].get("converted")
+
+    # only the file that failed to convert is tried again
+    p4k = P4KFile(str(tmp_path / "data.p4k"))
+    outdated = ExtractManifest(manifest).outdated(p4k.filelist, lambda m: str(output / m.filename), True)
+    assert [m.filename for m in outdated] == ["Data/broken.xml"]
+    assert ExtractManifest(manifest).outdated(p4k.filelist, lambda m: str(output / m.filename)) == []
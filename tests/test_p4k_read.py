@@ -0,0 +1,63 @@
+import gc
+import os
+import warnings
+
+import pytest
+
+from scdatatools.p4k import P4KFile, ContentCache
+from tests.helpers import build_p4k
+
+
+def test_iter_chunks(tmp_path):
+    data = os.urandom(1000) * 10
+    build_p4k(tmp_path / "data.p4k", {"Data/a.bin": data})
+    with P4KFile(str(tmp_path / "data.p4k")) as p4k:
+        chunks = list(p4k.iter_chunks("Data/a.bin", chunk_size=3000))
+    assert b"".join(chunks) == data
+    assert [len(c) for c in chunks] == [3000, 3000, 3000, 1000]
+
+
+def test_close_with_unfinished_iter_chunks(tmp_path):
+    build_p4k(tmp_path / "data.p4k", {"Data/a.bin": b"a" * 10000})
+    p4k = P4KFile(str(tmp_path / "data.p4k"))
+    chunks = p4k.iter_chunks("Data/a.bin", chunk_size=1000)
+    assert next(chunks) == b"a" * 1000
+    p4k.close()
+    assert p4k.fp is None
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_extract_workers_close_their_files(tmp_path, use_processes):
+    files = {f"Data/{i}.txt": str(i).encode() * 100 for i in range(32)}
+    build_p4k(tmp_path / "data.p4k", files)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", ResourceWarning)
+        with P4KFile(str(tmp_path / "data.p4k")) as p4k:
+            p4k.extractall(str(tmp_path / "out"), workers=4, batch_size=1, use_processes=use_processes)
+        gc.collect()
+    assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
+    for name, data in files.items():
+        assert (tmp_path / "out" / name).read_bytes() == data
+
+
+@pytest.mark.parametrize("content_cache", [True, 1024 * 1024, ContentCache()])
+def test_content_cache(tmp_path, content_cache):
+    build_p4k(tmp_path / "data.p4k", {"Data/a.txt": b"a" * 100})
+    with P4KFile(str(tmp_path / "data.p4k"), content_cache=content_cache) as p4k:
+        assert isinstance(p4k.content_cache, ContentCache)
+        assert p4k.read_bytes("Data/a.txt") == p4k.read_bytes("Data/a.txt") == b"a" * 100
+        assert p4k.content_cache.hits == 1
+
+
+@pytest.mark.parametrize("content_cache", [None, False])
+def test_no_content_cache(tmp_path, content_cache):
+    build_p4k(tmp_path / "data.p4k", {"Data/a.txt": b"a" * 100})
+    with P4KFile(str(tmp_path / "data.p4k"), content_cache=content_cache) as p4k:
+        assert p4k.content_cache is None
+        assert p4k.read_bytes("Data/a.txt") == b"a" * 100
+
+
+def test_invalid_content_cache(tmp_path):
+    build_p4k(tmp_path / "data.p4k", {"Data/a.txt": b"a" * 100})
+    with pytest.raises(TypeError):
+        P4KFile(str(tmp_path / "data.p4k"), content_cache="yes")